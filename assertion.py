@@ -1,3 +1,4 @@
+from multiprocessing.pool import ThreadPool
 import os
 
 def assert_non_empty_string(obj, field):
@@ -30,6 +31,33 @@ def assert_file_exists(obj, field):
           'Field "%s" must be an existing file' % field
 
 
+# Whether a file exists, by expanded filename, for the life of the process.
+_file_exists_cache = {}
+
+def files_exist(filenames, threads=0):
+    """Returns a map of filename to whether it is an existing file. Each
+       distinct filename is looked up once per process, on a pool of threads
+       if more than one is asked for."""
+    unknown = [filename for filename in set(filenames)
+               if not filename in _file_exists_cache]
+    if threads > 1 and len(unknown) > 1:
+        pool = ThreadPool(min(threads, len(unknown)))
+        try:
+            results = pool.map(os.path.isfile, unknown)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [os.path.isfile(filename) for filename in unknown]
+    _file_exists_cache.update(zip(unknown, results))
+    return dict([(filename, _file_exists_cache[filename])
+                 for filename in filenames])
+
+
+def clear_file_exists_cache():
+    _file_exists_cache.clear()
+
+
 def assert_contains(obj, field):
     assert field in obj, 'Must contain field "%s"' % field
 
@@ -0,0 +1,95 @@
+"""Measures the per-selection cost of expanding a pattern and filtering out
+   the suppressed selections, as the generator does for an expansion node.
+
+   Compares the expansion engine against the recursive expansion it replaced.
+
+   Usage: python -m bench.bench_expansion [--keys N] [--values N] [--repeat N]
+"""
+
+import time
+
+from expansion import Expansion
+from selection import SuppressionMatcher
+
+def recursive_permute(pattern, key_order=[], key_index=0, selection=None):
+    # The former Generator._permute, kept as the baseline.
+    if selection is None:
+        selection = {}
+
+    if key_index >= len(key_order):
+        yield selection
+        return
+
+    key = key_order[key_index]
+    for value in pattern[key]:
+        selection[key] = value
+        for next_selection in recursive_permute(pattern,
+                                                key_order,
+                                                key_index + 1,
+                                                selection):
+            yield next_selection
+
+def synthetic_pattern(keys, values):
+    pattern = {}
+    for k in range(0, keys):
+        pattern["key%d" % k] = ["value%d" % v for v in range(0, values)]
+    return pattern
+
+def suppression_for(pattern):
+    # Suppresses the selections with the first half of the values of a key.
+    matcher = SuppressionMatcher()
+    suppressed = dict(pattern)
+    suppressed["key0"] = pattern["key0"][:len(pattern["key0"]) / 2]
+    matcher.add(suppressed)
+    return matcher
+
+def select_recursive(pattern, matcher):
+    rules = matcher.restrict(pattern)
+    identity = matcher.identity(pattern)
+    for selection in recursive_permute(pattern, pattern.keys()):
+        if rules and matcher.matches_key(identity.key(selection), rules):
+            continue
+        yield selection
+
+def select_product(pattern, matcher):
+    rules = matcher.restrict(pattern)
+    expansion = Expansion(pattern)
+    identify = matcher.identity(pattern).indexed(expansion)
+    for indices in expansion.indices():
+        if rules and matcher.matches_key(identify(indices), rules):
+            continue
+        yield expansion.selection(indices)
+
+def measure(select, pattern, matcher, repeat):
+    best = None
+    for i in range(0, repeat):
+        start = time.time()
+        count = 0
+        for selection in select(pattern, matcher):
+            count += 1
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return count, best
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Benchmarks selecting from a synthetic pattern')
+    parser.add_argument('--keys', type=int, default=6)
+    parser.add_argument('--values', type=int, default=6)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    pattern = synthetic_pattern(args.keys, args.values)
+    matcher = suppression_for(pattern)
+    combinations = len(Expansion(pattern))
+    print "%d keys x %d values, %d combinations" % \
+          (args.keys, args.values, combinations)
+    for name, select in [("recursive", select_recursive),
+                         ("product", select_product)]:
+        count, elapsed = measure(select, pattern, matcher, args.repeat)
+        print "%-10s %8d selections  %7.3f s  %7.3f us/combination" % \
+              (name, count, elapsed, elapsed / combinations * 1e6)
+
+if __name__ == '__main__':
+    main()
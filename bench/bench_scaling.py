@@ -0,0 +1,179 @@
+"""Measures how the generator scales with the shape of the specification.
+
+   Every case runs in its own process, generating into an in-memory writer,
+   and reports selections/s, bytes/s and the peak resident set size. The
+   results can be saved as a baseline and later runs compared against it.
+
+   Usage: python -m bench.bench_scaling [--repeat N] [--case NAME]
+                                        [--save FILE] [--baseline FILE]
+                                        [--tolerance FRACTION]
+"""
+
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from bench.synthetic import synthetic_case
+from generator import Generator
+from progress import Reporter, QUIET
+from util import format_table, load_json
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "baseline.json")
+REFERRER_POLICY = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "..", "examples", "referrer-policy")
+
+SYNTHETIC_CASES = [
+    ("baseline", {"leaves": 16}),
+    ("leaves-64", {"leaves": 64}),
+    ("keys-8", {"keys": 8, "values": 3}),
+    ("values-16", {"keys": 3, "values": 16, "leaves": 8}),
+    ("depth-8", {"depth": 8, "leaves": 16}),
+    ("suppressed-90", {"suppression": 0.9, "values": 10, "leaves": 16}),
+    ("template-64k", {"template_size": 65536}),
+]
+
+class MemoryWriter(object):
+    """Keeps the outputs in memory, counting the bytes written."""
+
+    def __init__(self):
+        self.files = {}
+        self.outputs = 0
+        self.bytes = 0
+
+    def write(self, filename, content):
+        self.files[filename] = content
+        self.outputs += 1
+        self.bytes += len(content)
+
+    def close(self):
+        pass
+
+def referrer_policy_case(directory):
+    """Returns the referrer-policy example with the subresource files, which
+       live in a web-platform-tests checkout, replaced by empty files."""
+    spec = load_json(os.path.join(REFERRER_POLICY, "rp-spec.src.json"))
+    schema = load_json(os.path.join(REFERRER_POLICY, "rp-spec.vs.json"))
+    for name, filename in spec["subresource_path"].items():
+        placeholder = os.path.join(directory, os.path.basename(filename))
+        open(placeholder, "w").close()
+        spec["subresource_path"][name] = placeholder
+    return spec, schema
+
+def _run(name, repeat, results):
+    directory = tempfile.mkdtemp()
+    try:
+        best = None
+        for i in range(0, repeat):
+            if name == "referrer-policy":
+                spec, schema = referrer_policy_case(directory)
+                paths = [os.path.abspath(REFERRER_POLICY)]
+            else:
+                spec, schema = synthetic_case(**dict(SYNTHETIC_CASES)[name])
+                paths = None
+            writer = MemoryWriter()
+            reporter = Reporter(level=QUIET)
+            generator = Generator(spec, schema, writer=writer, paths=paths,
+                                  reporter=reporter)
+            started = time.time()
+            generator.generate()
+            elapsed = time.time() - started
+            if best is None or elapsed < best["seconds"]:
+                best = {"selections": reporter.generated,
+                        "outputs": writer.outputs,
+                        "bytes": writer.bytes,
+                        "seconds": elapsed}
+        best["selections_per_second"] = best["selections"] / best["seconds"]
+        best["bytes_per_second"] = best["bytes"] / best["seconds"]
+        # Kilobytes on Linux.
+        best["peak_rss_kb"] = \
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        results.put(best)
+    except Exception, err:
+        results.put({"error": "%s: %s" % (err.__class__.__name__, err)})
+    finally:
+        shutil.rmtree(directory)
+
+def run_case(name, repeat=3):
+    """Runs a case in a new process so its peak RSS is its own."""
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run,
+                                      args=(name, repeat, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+def compare(results, baseline):
+    """Returns the selections/s of each case relative to the baseline."""
+    ratios = {}
+    for name, result in results.iteritems():
+        previous = baseline.get(name)
+        if previous is None or "error" in result or "error" in previous:
+            continue
+        ratios[name] = result["selections_per_second"] / \
+                       previous["selections_per_second"]
+    return ratios
+
+def format_results(names, results, ratios):
+    rows = [("Case", "Selections", "Outputs", "Seconds", "Selections/s",
+             "MB/s", "Peak RSS (MB)", "vs baseline")]
+    for name in names:
+        result = results[name]
+        if "error" in result:
+            rows.append((name, result["error"], "", "", "", "", "", ""))
+            continue
+        ratio = ratios.get(name)
+        rows.append((name, str(result["selections"]), str(result["outputs"]),
+                     "%.3f" % result["seconds"],
+                     "%.0f" % result["selections_per_second"],
+                     "%.1f" % (result["bytes_per_second"] / 1e6),
+                     "%.1f" % (result["peak_rss_kb"] / 1024.0),
+                     "%.2fx" % ratio if ratio is not None else "-"))
+    return format_table(rows)
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the generator on synthetic and real cases')
+    parser.add_argument('--repeat', type=int, default=3,
+        help='Runs per case, the fastest one is reported')
+    parser.add_argument('--case', action='append', default=None,
+        help='Runs only the named case, can be repeated')
+    parser.add_argument('--save', nargs='?', default=None, const=BASELINE,
+        help='Saves the results as the baseline')
+    parser.add_argument('--baseline', default=BASELINE,
+        help='Baseline results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+        help='Slowdown against the baseline reported as a regression')
+    args = parser.parse_args()
+
+    names = args.case or \
+            [name for name, shape in SYNTHETIC_CASES] + ["referrer-policy"]
+    results = {}
+    for name in names:
+        results[name] = run_case(name, repeat=args.repeat)
+
+    baseline = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["cases"]
+    ratios = compare(results, baseline)
+    print format_results(names, results, ratios)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"cases": results}, f, indent=2, sort_keys=True)
+    regressions = sorted([name for name, ratio in ratios.iteritems()
+                          if ratio < 1 - args.tolerance])
+    if regressions:
+        print "Slower than the baseline: %s" % ", ".join(regressions)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""Synthetic spec and schema pairs for benchmarking the generator."""
+
+def synthetic_case(depth=1, leaves=4, keys=4, values=4, suppression=0.25,
+                   template_size=1024):
+    """Returns a (spec, schema) pair.
+
+       The spec nests depth levels of named groups, the innermost one holding
+       leaves expansion patterns which expand keys keys of values values
+       each. The suppression is the fraction of the selections which are
+       suppressed, rounded to whole values of the first key. The content
+       template references every key and is padded to template_size bytes."""
+    key_names = ["key%d" % k for k in range(0, keys)]
+    scenario_schema = {}
+    for key in key_names:
+        scenario_schema[key] = ["%s-value%d" % (key, v)
+                                for v in range(0, values)]
+
+    path = "%(__index__)s-" + "-".join(["%%(%s)s" % key
+                                        for key in key_names]) + ".html"
+    template = " ".join(["%%(%s)s" % key for key in key_names])
+    template += "\n" + "x" * max(0, template_size - len(template) - 1)
+    leaf_schema = {
+        "matches": "@scenario_schema",
+        "action": "generate",
+        "path": "/".join(["%%(%sname)s" % ("_" * level)
+                          for level in range(depth, 0, -1)] + [path]),
+        "template": template
+    }
+
+    scenarios = [dict([(key, "*") for key in key_names])
+                 for i in range(0, leaves)]
+    group = {"scenarios": scenarios}
+    group_schema = {"/scenarios/*": leaf_schema}
+    for level in range(depth - 1, -1, -1):
+        group["name"] = "group%d" % level
+        group_schema["matches"] = {"name": "non_empty_string",
+                                   "scenarios" if level == depth - 1
+                                   else "groups": "non_empty_list"}
+        group, group_schema = {"groups": [group]}, {"/groups/*": group_schema}
+
+    suppressed_values = int(round(suppression * values))
+    spec, schema = group, group_schema
+    schema["#scenario_schema"] = scenario_schema
+    if suppressed_values > 0:
+        suppressed = dict([(key, "*") for key in key_names])
+        suppressed[key_names[0]] = \
+            scenario_schema[key_names[0]][:suppressed_values]
+        spec["excluded"] = [suppressed]
+        schema["/excluded/*"] = {"matches": "@scenario_schema",
+                                 "action": "suppress"}
+    return spec, schema
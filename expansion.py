@@ -0,0 +1,71 @@
+import itertools
+
+class Expansion(object):
+    """The selections of a pattern, expanded without recursion.
+
+       Selections are walked as tuples of value indices in the pattern's key
+       order, the last key varying fastest. A selection dict is only built
+       when asked for and is never shared, so consumers can keep or modify
+       it."""
+
+    def __init__(self, pattern):
+        self.keys = tuple(pattern.keys())
+        self.value_lists = [pattern[key] for key in self.keys]
+
+    def __len__(self):
+        count = 1
+        for values in self.value_lists:
+            count *= len(values)
+        return count
+
+    def __iter__(self):
+        keys = self.keys
+        for values in itertools.product(*self.value_lists):
+            yield dict(itertools.izip(keys, values))
+
+    def indices(self, start=0, stop=None):
+        """Yields the index tuples of the selections in expansion order, from
+           the offset start up to the offset stop."""
+        if start == 0 and (stop is None or stop >= len(self)):
+            return itertools.product(*[xrange(len(values))
+                                       for values in self.value_lists])
+        if stop is None:
+            stop = len(self)
+        return itertools.islice(self._indices_from(start),
+                                max(0, stop - start))
+
+    def _indices_from(self, start):
+        if start >= len(self):
+            return
+        sizes = [len(values) for values in self.value_lists]
+        indices = list(self.indices_at(start))
+        while True:
+            yield tuple(indices)
+            # Count up, the last key varying fastest.
+            position = len(indices) - 1
+            while position >= 0:
+                indices[position] += 1
+                if indices[position] < sizes[position]:
+                    break
+                indices[position] = 0
+                position -= 1
+            if position < 0:
+                return
+
+    def selection(self, indices):
+        """Returns the selection of an index tuple."""
+        return dict(itertools.izip(self.keys,
+                                   [values[index] for values, index
+                                    in itertools.izip(self.value_lists,
+                                                      indices)]))
+
+    def indices_at(self, offset):
+        """Returns the index tuple of the selection at the offset."""
+        if offset < 0 or offset >= len(self):
+            raise IndexError("Selection offset out of range: %d" % offset)
+        indices = []
+        for values in reversed(self.value_lists):
+            offset, index = divmod(offset, len(values))
+            indices.append(index)
+        indices.reverse()
+        return tuple(indices)
@@ -1,105 +1,457 @@
-from validator import Validator, SchemaError, SpecError, TemplateError
-from util import load_json, normalize_path, filter_comments
+from validator import Validator, CompiledSchema, SchemaError, SpecError, \
+                      TemplateError
+from util import load_json, normalize_path, filter_comments, content_digest
+from template import Template, RenderCache
+from selection import SuppressionMatcher, NodeLayers, WhenCondition
+from writer import OutputWriter, DryRunWritter, ManifestWriter, \
+                   ThreadedWriter, ArchiveWriter, DedupWriter
+from incremental import DependencyCache, digest
+from expansion import Expansion
+from plan import Plan, BudgetError
+from progress import Reporter, LEVELS, QUIET, SUMMARY
+from profiling import Profiler
+from streaming import StreamedSpec, StreamedArray, StreamError
+from sharding import ShardWriter, parse_shard, shard_range
+from watch import Watcher, signature
+from assertion import clear_file_exists_cache
+import copy
+import errno
+import multiprocessing
 import os
-import re
+import stat
 
-class OutputWriter(object):
-    def write(self, filename, content):
-        full_path = os.path.dirname(filename)
-        try:
-            os.makedirs(full_path)
-        except:
-            pass
-        with open(filename, "w") as f:
-            f.write(content)
-
-class DryRunWritter(object):
-    def write(self, filename, content):
-        print filename, content
+class ReadError(IOError):
+    """Error raised when a template cannot be read."""
+    pass
 
 class FileReader(object):
+    """Reads templates from the search paths.
+
+       Contents are cached by resolved path and reused for as long as the
+       file's mtime and size stay the same."""
+
+    def __init__(self):
+        self._cache = {}
+        self.hits = 0
+        self.misses = 0
+        # The (mtime, size) of each file read, by resolved path, since it was
+        # last emptied.
+        self.read_signatures = {}
+
     def read(self, filename, paths=None):
         if paths is None:
             paths = [os.getcwd()]
         for path in paths:
-            full_path = os.path.join(path, filename)
-            if os.path.isfile(full_path):
-                return open(full_path, "r").read()
-        raise IOError("Cannot find file %s", filename)
+            full_path = os.path.abspath(os.path.join(path, filename))
+            try:
+                stat_result = os.stat(full_path)
+            except OSError:
+                continue
+            if not stat.S_ISREG(stat_result.st_mode):
+                continue
+
+            signature = (stat_result.st_mtime, stat_result.st_size)
+            self.read_signatures[full_path] = signature
+            cached = self._cache.get(full_path)
+            if cached is not None and cached[0] == signature:
+                self.hits += 1
+                return cached[1]
+
+            self.misses += 1
+            try:
+                with open(full_path, "r") as f:
+                    content = f.read()
+            except IOError, err:
+                raise ReadError(err.errno, err.strerror, full_path)
+            self._cache[full_path] = (signature, content)
+            return content
+        raise ReadError(errno.ENOENT, "Cannot find file", filename)
+
+    def clear(self):
+        self._cache = {}
+
+# The generator shared with forked workers of the rendering process pool.
+_worker_generator = None
+
+def _render_batch(batch):
+    outputs = []
+    for node_index, selection_index, selection in batch:
+        for file_path, content in _worker_generator._render(node_index,
+                                                            selection_index,
+                                                            selection):
+            outputs.append((node_index, file_path, content))
+    reads = _worker_generator._reads
+    if reads is not None:
+        _worker_generator._reads = {}
+    return outputs, reads
 
 class Generator(object):
     def __init__(self, spec, schema,
-                 reader=None, writer=None, mode="release", paths=None):
+                 reader=None, writer=None, mode="release", paths=None,
+                 jobs=1, batch_size=64, dependencies=None, reporter=None,
+                 file_check_threads=0, shard=None):
         self.spec = spec
-        self.schema = schema
+        if isinstance(schema, CompiledSchema):
+            self.compiled_schema = schema
+            self.schema = schema.schema
+        else:
+            self.compiled_schema = None
+            self.schema = schema
         self.mode = mode
         self.writer = writer if not writer is None else OutputWriter()
         self.reader = reader if not reader is None else FileReader()
         self.paths = paths
+        self.jobs = jobs
+        self.batch_size = batch_size
+        self.dependencies = dependencies
+        self.file_check_threads = file_check_threads
+        # (i, N) to generate only the i-th of N contiguous blocks of the
+        # selection indices.
+        self.shard = shard
+        self.selection_range = None
+        self.selection_count = None
+        self.reporter = reporter if not reporter is None else \
+                        Reporter(level=QUIET)
+        self._templates = {}
+        self._prepared = False
 
     def generate(self, error_details={}):
-        v = Validator(self.spec, self.schema)
+        if isinstance(self.spec, StreamedSpec):
+            self._generate_streamed(error_details)
+            return
+        if not self._prepared:
+            self._prepare(error_details)
+        self._prepared = False
+        selections = self._select()
+        if self.jobs > 1:
+            outputs = self._render_parallel(selections)
+        else:
+            outputs = self._render_serial(selections)
+        self.reporter.finish(self._write(outputs))
+
+        if self.dependencies is not None:
+            self._record_dependencies()
+
+    def _write(self, outputs):
+        output_count = 0
+        for node_index, file_path, content in outputs:
+            self.writer.write(file_path, content)
+            output_count += 1
+            if self.dependencies is not None:
+                self._node_outputs[node_index].append(file_path)
+        return output_count
+
+    def _generate_streamed(self, error_details):
+        """Generates from a spec whose top-level arrays are read entry by
+           entry, so only one entry is held in memory at a time.
+
+           A first pass validates the entries, collects the suppress
+           patterns and counts the selections. A second pass reads the
+           arrays again and generates each entry as it is read. The arrays
+           are generated in the order the spec would be traversed if it was
+           loaded at once, which keeps the __index__ values the same."""
+        if self.compiled_schema is None:
+            self.compiled_schema = CompiledSchema(self.schema)
+        v = Validator(None, self.compiled_schema,
+                      file_check_threads=self.file_check_threads)
+        v.start()
+        self._prepare_schema(v)
+
+        # Arrays with rules of their own are validated as a whole.
+        checks = self.compiled_schema.checks
+        streamed_key = lambda key: not normalize_path("/" + key) in checks
+
+        # Top-level members in file order, so iterating the dict visits them
+        # in the same order as the dict the spec would be loaded into.
+        root = {}
+        streamed_keys = set()
+        counts = []
+        for key, value in self.spec.items(streamed=streamed_key):
+            if not isinstance(value, StreamedArray):
+                root[key] = value
+                continue
+            # The top-level rules only need to know whether it is empty.
+            root[key] = []
+            streamed_keys.add(key)
+            array_path = self._paths.child("/", key)
+            generic_path = self._paths.generic_child("/", key)
+            for index, entry in enumerate(value):
+                if index == 0:
+                    root[key] = [copy.deepcopy(entry)]
+                if self._is_assoc(entry):
+                    v.validate_value(entry, array_path + "/*",
+                                     error_details=error_details)
+                counts.extend(self._scan(self._traverse_child(
+                    index, entry, array_path, generic_path, [], None)))
+
+        v.validate_value(root, "/", error_details=error_details,
+                         skip_keys=streamed_keys)
+        v.finish(error_details=error_details)
+        for key, value in root.iteritems():
+            if not key in streamed_keys:
+                counts.extend(self._scan(self._traverse_child(
+                    key, value, "/", "/", [], None)))
+
+        self.reporter.start(len(counts), sum(counts))
+        selection_index = 0
+        output_count = 0
+        for key, value in root.iteritems():
+            if key in streamed_keys:
+                array_path = self._paths.child("/", key)
+                generic_path = self._paths.generic_child("/", key)
+                # Lazily, so each entry is released once it is generated.
+                parts = (self._traverse_child(index, entry, array_path,
+                                              generic_path, [], "generate")
+                         for index, entry
+                         in enumerate(self.spec.entries(key)))
+            else:
+                parts = [self._traverse_child(key, value, "/", "/", [],
+                                              "generate")]
+            for expansion_nodes in parts:
+                self._expansion_nodes = list(expansion_nodes)
+                self._node_offsets = []
+                self._node_layers = {}
+                for path, named_chain, pattern, node_path \
+                        in self._expansion_nodes:
+                    self._node_offsets.append(selection_index)
+                    selection_index += self._count(pattern)
+                for node_index in range(0, len(self._expansion_nodes)):
+                    output_count += self._write(self._render_serial(
+                        self._select_node(node_index, report=True)))
+        self.reporter.finish(output_count)
+
+    def _scan(self, expansion_nodes):
+        """Adds the suppress patterns and checks the generate patterns,
+           returning how many selections each of them expands into."""
+        suppress_nodes, generate_nodes = self._classify(expansion_nodes)
+        for path, named_chain, pattern, node_path in suppress_nodes:
+            self.reporter.suppress(filter_comments(pattern))
+            self._suppression.add(pattern)
+        counts = []
+        for expansion_node in generate_nodes:
+            self._check_template_keys(*expansion_node)
+            counts.append(self._count(expansion_node[2]))
+        return counts
+
+    def plan(self, error_details={}):
+        """Counts what generate() is going to produce without expanding the
+           selections. A following generate() reuses the preparation."""
+        self._prepare(error_details)
+        self._prepared = True
+        plan = Plan()
+        selection_index = 0
+        for node_index in range(0, len(self._expansion_nodes)):
+            path, named_chain, pattern, node_path = \
+                self._expansion_nodes[node_index]
+            combinations = self._count(pattern)
+            suppressed = self._suppression.count(pattern)
+            sample_outputs = []
+            if combinations > suppressed:
+                sample_outputs = self._render_sample(node_index,
+                                                     selection_index)
+            plan.add_node(path, combinations, suppressed, sample_outputs)
+            selection_index += combinations
+        return plan
+
+    def _render_sample(self, node_index, selection_index):
+        pattern = self._expansion_nodes[node_index][2]
+        suppression_rules = self._suppression.restrict(pattern)
+        expansion = Expansion(pattern)
+        identify = self._suppression.identity(pattern).indexed(expansion)
+        for indices in expansion.indices():
+            if not suppression_rules or not self._suppression.matches_key(
+                    identify(indices), suppression_rules):
+                return self._render(node_index, selection_index,
+                                    expansion.selection(indices))
+            selection_index += 1
+        return []
+
+    def _validate(self, error_details):
+        if self.compiled_schema is None:
+            self.compiled_schema = CompiledSchema(self.schema)
+        v = Validator(self.spec, self.compiled_schema,
+                      file_check_threads=self.file_check_threads)
         v.validate(error_details=error_details)
+        return v
+
+    def _prepare(self, error_details):
+        v = self._validate(error_details)
+        self._prepare_schema(v)
+
+        suppress_nodes, self._expansion_nodes = \
+            self._classify(self._traverse(None, self.spec))
+        for path, named_chain, pattern, node_path in suppress_nodes:
+            self.reporter.suppress(filter_comments(pattern))
+            self._suppression.add(pattern)
+
+        for expansion_node in self._expansion_nodes:
+            self._check_template_keys(*expansion_node)
+
+    def _prepare_schema(self, v):
         self._leafs = v.leafs
         self._meta_schema_map = v.meta_schema_map
-        self._re_integer_pattern = re.compile('^[0-9]+$')
+        self._paths = self.compiled_schema.paths
         self._path_action = {}
         self._identify_path_actions(None, self.schema)
-        self._excluded_selections = {}
-
-        for expansion_node in self._traverse(None, self.spec,
-                                             match_action="suppress"):
-            path, named_chain, pattern = expansion_node
-            for selection in self._permute_pattern(pattern):
-                serialized_selection = self._serialize(selection)
-                print "To be excluded", serialized_selection
-                self._excluded_selections[serialized_selection] = True
-
-        selection_index = -1
-        for expansion_node in self._traverse(None, self.spec,
-                                             match_action="generate"):
-            path, named_chain, pattern = expansion_node
-            for selection in self._permute_pattern(pattern):
-                selection_index += 1
-                serialized_selection = self._serialize(selection)
-                if serialized_selection in self._excluded_selections:
-                    print "Excluding", selection
-                    continue
-                print "Generating", selection
-                extensions = self._leafs[path]["extensions"]
-                extended_selection = self._extend(selection,
-                                                  named_chain,
-                                                  selection_index,
-                                                  extensions)
-
-                # When clause handler.
-                when_rules = self._leafs[path]["when"]
-                self._run_when_rules(when_rules, extended_selection)
-
-                # The generate action.
-                path_template = self._leafs[path]["path"]
-                content_template = self._resolve_template(
-                    self._leafs[path]["template"], extended_selection)
-                file_path = self._produce(path_template,
-                                          extended_selection,
-                                          check_produces=False)
-                content = self._produce(content_template,
-                                        extended_selection,
-                                        reference=self._leafs[path]["template"],
-                                        check_produces=False)
-                self.writer.write(file_path, content)
-
-    def _run_when_rules(self, when_rules, extended_selection):
-        if when_rules is None:
-            return
+        self._suppression = SuppressionMatcher()
+        self._node_offsets = []
+        self._node_outputs = {}
+        self._reused_nodes = {}
+        self._reads = {} if self.dependencies is not None else None
+        self._current_node = None
+        self._template_digests = {}
+        self._selection_start = 0
+        self._node_layers = {}
+        self._compiled_when_rules = {}
+        self._subtemplate_outputs = RenderCache()
 
-        for when_rule in when_rules:
-            match_any_clause = when_rule["match_any"]
-            if not self._when_rule_match_any(match_any_clause,
-                                             extended_selection):
+    def _select(self):
+        """Yields (node index, selection index, selection) for each selection
+           to be generated. The selection index is the __index__ and counts
+           the suppressed selections too. With a shard only the selections
+           in its range of indices are yielded."""
+        counts = [self._count(node[2]) for node in self._expansion_nodes]
+        start, stop = 0, sum(counts)
+        if self.shard is not None:
+            start, stop = shard_range(self.shard[0], self.shard[1], stop)
+        self.selection_range = (start, stop)
+        self.selection_count = sum(counts)
+        self._selection_start = start
+        self.reporter.start(len(counts), stop - start)
+        selection_index = 0
+        self._node_offsets = []
+        for node_index in range(0, len(self._expansion_nodes)):
+            self._node_offsets.append(selection_index)
+            node_start = max(0, start - selection_index)
+            node_stop = min(counts[node_index], stop - selection_index)
+            if self.shard is not None and node_start >= node_stop:
+                # Another shard generates the node.
+                selection_index += counts[node_index]
                 continue
+            if self.dependencies is None or not self._reuse_node(node_index):
+                for selection in self._select_node(node_index, report=True,
+                                                   start=node_start,
+                                                   stop=node_stop):
+                    yield selection
+            else:
+                path, named_chain, pattern, node_path = \
+                    self._expansion_nodes[node_index]
+                self.reporter.node(path, node_path, counts[node_index], 0,
+                                   reused=True)
+            selection_index += counts[node_index]
 
-            for do_rule in when_rule["do"]:
+    def _select_node(self, node_index, report=False, start=0, stop=None):
+        """Yields the selections of a node which are not suppressed, out of
+           those at the offsets start up to stop of its expansion."""
+        path, named_chain, pattern, node_path = \
+            self._expansion_nodes[node_index]
+        selection_index = self._node_offsets[node_index] + start - 1
+        suppression_rules = self._suppression.restrict(pattern)
+        expansion = Expansion(pattern)
+        identify = self._suppression.identity(pattern).indexed(expansion)
+        reporter = self.reporter
+        tracing = report and reporter.tracing
+        check_interval = reporter.check_interval if report else 0
+        generated = 0
+        for indices in expansion.indices(start, stop):
+            selection_index += 1
+            if check_interval and selection_index % check_interval == 0:
+                reporter.progress(selection_index - self._selection_start,
+                                  generated)
+            if suppression_rules and self._suppression.matches_key(
+                    identify(indices), suppression_rules):
+                if tracing:
+                    reporter.selection("exclude", selection_index,
+                                       expansion.selection(indices))
+                continue
+            selection = expansion.selection(indices)
+            if tracing:
+                reporter.selection("generate", selection_index, selection)
+            generated += 1
+            yield node_index, selection_index, selection
+        if report:
+            combinations = len(expansion) if stop is None else stop
+            reporter.node(path, node_path, combinations - start, generated)
+
+    def _count(self, pattern):
+        return len(Expansion(pattern))
+
+    def _render_serial(self, selections):
+        for node_index, selection_index, selection in selections:
+            for file_path, content in self._render(node_index,
+                                                   selection_index,
+                                                   selection):
+                yield node_index, file_path, content
+
+    def _render_parallel(self, selections):
+        """Renders batches of selections on a process pool.
+
+           The workers are forked after the generator is prepared and share
+           its state. Outputs come back in selection order so the writes, and
+           which of colliding paths wins, are the same as in a serial run."""
+        global _worker_generator
+        _worker_generator = self
+        pool = multiprocessing.Pool(self.jobs)
+        try:
+            batches = self._batch(selections, self.batch_size)
+            for outputs, reads in pool.imap(_render_batch, batches):
+                if reads:
+                    for node_index, filenames in reads.iteritems():
+                        self._reads.setdefault(node_index,
+                                               set()).update(filenames)
+                for output in outputs:
+                    yield output
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            _worker_generator = None
+
+    def _batch(self, selections, batch_size):
+        batch = []
+        for node_index, selection_index, selection in selections:
+            batch.append((node_index, selection_index, selection))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _render(self, node_index, selection_index, selection):
+        """Returns the (file path, content) outputs of a selection in the
+           order they are to be written."""
+        path, named_chain, pattern, node_path = \
+            self._expansion_nodes[node_index]
+        self._current_node = node_index
+        outputs = []
+        extended_selection = self._extend(node_index, selection,
+                                          selection_index)
+
+        # When clause handler.
+        self._run_when_rules(path, extended_selection, outputs)
+
+        # The generate action.
+        path_template = self._leafs[path]["path"]
+        content_template = self._resolve_template(
+            self._leafs[path]["template"], extended_selection)
+        file_path = self._produce(path_template,
+                                  extended_selection,
+                                  check_produces=False)
+        content = self._produce(content_template,
+                                extended_selection,
+                                reference=self._leafs[path]["template"],
+                                check_produces=False)
+        outputs.append((file_path, content))
+        return outputs
+
+    def _run_when_rules(self, path, extended_selection, outputs):
+        for condition, do_rules in self._when_rules(path):
+            if not condition.matches(extended_selection):
+                continue
+
+            for do_rule in do_rules:
                 action = do_rule["action"]
 
                 if action == "generate":
@@ -111,7 +463,7 @@ class Generator(object):
                     content = self._produce(content_template,
                                             extended_selection,
                                             reference=do_rule["template"])
-                    self.writer.write(file_path, content)
+                    outputs.append((file_path, content))
                 elif action == "update_extensions":
                     for extension_key, extension_template in do_rule["extensions"].iteritems():
                         content_template = self._resolve_template(
@@ -123,10 +475,191 @@ class Generator(object):
                 else:
                     raise ValueError("Invalid do action: %s" % action)
 
+    def _reuse_node(self, node_index):
+        """Tells whether the outputs of the expansion node recorded by the
+           previous run are still valid, in which case they are kept."""
+        node_path = self._expansion_nodes[node_index][3]
+        record = self.dependencies.previous(node_path)
+        self._node_outputs[node_index] = []
+        if record is None or \
+           record["digest"] != self._node_digest(node_index, record["keys"]):
+            return False
+        for filename, template_digest in record["templates"].iteritems():
+            if self._template_digest(filename) != template_digest:
+                return False
+        for file_path in record["outputs"]:
+            if not os.path.isfile(file_path):
+                return False
+
+        del self._node_outputs[node_index]
+        self._reused_nodes[node_index] = record
+        self.dependencies.reuse(node_path)
+        retain = getattr(self.writer, "retain", None)
+        if retain is not None:
+            for file_path in record["outputs"]:
+                retain(file_path)
+        return True
+
+    def _node_digest(self, node_index, keys):
+        """Digests the inputs of an expansion node. Only the ancestor values
+           referenced by the given template keys are taken into account."""
+        path, named_chain, pattern, node_path = \
+            self._expansion_nodes[node_index]
+        ancestors = []
+        depth = 0
+        for ancestor in reversed(named_chain):
+            depth += 1
+            for key in keys:
+                if key.startswith("_" * depth) and key[depth:] in ancestor:
+                    ancestors.append((key, ancestor[key[depth:]]))
+        suppression = self._suppression.describe(
+            pattern, self._suppression.restrict(pattern))
+        # The position in the global selection order only matters to outputs
+        # which use the __index__.
+        offset = self._node_offsets[node_index] if "__index__" in keys \
+                 else None
+        return digest(path, self._leafs[path], self.mode, offset,
+                      [(k, pattern[k]) for k in pattern.keys()],
+                      sorted(ancestors), suppression)
+
+    def _template_digest(self, filename):
+        try:
+            return self._template_digests[filename]
+        except KeyError:
+            try:
+                template_digest = content_digest(
+                    self.reader.read(filename, self.paths))
+            except IOError:
+                template_digest = None
+            self._template_digests[filename] = template_digest
+            return template_digest
+
+    def _record_dependencies(self):
+        written_by = {}
+        for node_index, outputs in self._node_outputs.iteritems():
+            for file_path in outputs:
+                written_by[file_path] = max(node_index,
+                                            written_by.get(file_path, -1))
+        self._repair_reused_outputs(written_by)
+
+        for node_index, outputs in self._node_outputs.iteritems():
+            path, named_chain, pattern, node_path = \
+                self._expansion_nodes[node_index]
+            keys = set(self._leaf_template_keys(path))
+            templates = {}
+            for filename in self._reads.get(node_index, []):
+                templates[filename] = self._template_digest(filename)
+                keys.update(self._compile(
+                    self.reader.read(filename, self.paths)).keys)
+            unique_outputs = []
+            seen = set()
+            for file_path in outputs:
+                if not file_path in seen:
+                    seen.add(file_path)
+                    unique_outputs.append(file_path)
+            self.dependencies.record(node_path,
+                                     self._node_digest(node_index, keys),
+                                     keys, templates, unique_outputs)
+
+    def _repair_reused_outputs(self, written_by):
+        """Rewrites the outputs of kept expansion nodes which would have been
+           the last to write a path that was overwritten in this run, or
+           was last written by a node which changed."""
+        touched = set(written_by.keys())
+        reused_paths = set([self._expansion_nodes[node_index][3]
+                            for node_index in self._reused_nodes])
+        for node_path in self.dependencies.node_paths():
+            if not node_path in reused_paths:
+                touched.update(self.dependencies.previous_outputs(node_path))
+
+        last_reused = {}
+        for node_index, record in self._reused_nodes.iteritems():
+            for file_path in record["outputs"]:
+                if file_path in touched:
+                    last_reused[file_path] = max(
+                        node_index, last_reused.get(file_path, -1))
+
+        repairs = {}
+        for file_path, node_index in last_reused.iteritems():
+            if node_index > written_by.get(file_path, -1):
+                repairs.setdefault(node_index, set()).add(file_path)
+
+        for node_index in sorted(repairs.keys()):
+            outputs = self._render_serial(self._select_node(node_index))
+            for node_index, file_path, content in outputs:
+                if file_path in repairs[node_index]:
+                    self.writer.write(file_path, content)
+
+    def _compile(self, source):
+        """Returns the compiled template for the source, parsing it once."""
+        try:
+            return self._templates[source]
+        except KeyError:
+            template = Template(source)
+            self._templates[source] = template
+            return template
+
+    def _leaf_templates(self, path):
+        """Returns the inline templates of a leaf and the keys the leaf itself
+           provides for them."""
+        leaf = self._leafs[path]
+        provided = set(["__mode__", "__index__"])
+        if leaf["extensions"] is not None:
+            provided.update(leaf["extensions"].keys())
+
+        templates = [leaf["path"], leaf["template"]]
+        for when_rule in leaf["when"] or []:
+            for match_clause in when_rule["match_any"]:
+                templates.extend(match_clause)
+            for do_rule in when_rule["do"]:
+                if do_rule["action"] == "generate":
+                    templates.extend([do_rule["path"], do_rule["template"]])
+                elif do_rule["action"] == "update_extensions":
+                    provided.update(do_rule["extensions"].keys())
+                    templates.extend(do_rule["extensions"].values())
+
+        for template in list(templates):
+            if isinstance(template, dict):
+                provided.update(template.keys())
+                templates.extend(template.values())
+
+        return [template for template in templates
+                if isinstance(template, basestring)], provided
+
+    def _leaf_template_keys(self, path):
+        keys = set()
+        for template in self._leaf_templates(path)[0]:
+            keys.update(self._compile(template).keys)
+        return keys
+
+    def _check_template_keys(self, path, named_chain, pattern, node_path):
+        """Raises SchemaError up front for inline templates of the leaf which
+           reference keys no selection of the expansion node can provide."""
+        templates, available = self._leaf_templates(path)
+        available.update(pattern.keys())
+        prefix = "_"
+        for ancestor in reversed(named_chain):
+            available.update([prefix + k for k in ancestor.keys()])
+            prefix += "_"
+
+        for template in templates:
+            try:
+                missing = self._compile(template).keys - available
+            except ValueError, err:
+                raise SchemaError("Invalid template:\n%s\n\nValueError: %s" % \
+                                  (template, err.message))
+            if missing:
+                raise SchemaError("Invalid template:\n%s\n\n" % template + \
+                                  "Undefined keys at %s: %s" % \
+                                  (path, ", ".join(sorted(missing))))
+
     def _produce(self, template, values, reference="inline",
-                 check_produces=False):
+                 check_produces=False, cache=None):
         try:
-            produced_value = template % values
+            if cache is None:
+                produced_value = self._compile(template).render(values)
+            else:
+                produced_value = cache.render(self._compile(template), values)
             if check_produces and produced_value == template:
                 raise TemplateError("Template did not produce a value:\n%s" % \
                                     str(reference))
@@ -143,24 +676,28 @@ class Generator(object):
                               (template, err.message))
 
 
-    def _serialize(self, selection):
-        # TODO(kristijanburnik): this is a hack to omit names. It should be
-        # documented or there should be a way to specify which patterns match.
-        return str(filter_comments(selection))
-
-    def _when_rule_match_any(self, match_any_clause, extended_selection):
-        for first, second in match_any_clause:
-            first %= extended_selection
-            second %= extended_selection
-            if first == second:
-                return True
-        return False
+    def _when_rules(self, path):
+        """Returns the (condition, do rules) of the when rules of a leaf,
+           compiled once. Rules which can never match are left out."""
+        try:
+            return self._compiled_when_rules[path]
+        except KeyError:
+            rules = []
+            for when_rule in self._leafs[path]["when"] or []:
+                condition = WhenCondition(
+                    [(self._compile(first), self._compile(second))
+                     for first, second in when_rule["match_any"]])
+                if not condition.never:
+                    rules.append((condition, when_rule["do"]))
+            self._compiled_when_rules[path] = rules
+            return rules
 
     def _resolve_template(self, mixed, extended_selection):
         if isinstance(mixed, dict):
             # TODO(kristijanburnik): Raise error if missing key for template.
-            filename = mixed["__main__"] % extended_selection
-            template = self.reader.read(filename, self.paths)
+            filename = self._compile(mixed["__main__"]).render(
+                extended_selection)
+            template = self._read(filename)
 
             # Unwrap and apply the subtemplates first.
             # TODO(kristijanburnik): This is hacky and not very useful in
@@ -174,59 +711,36 @@ class Generator(object):
                                                      extended_selection,
                                                      reference=(filename, template_key),
                                                      check_produces=False)
-                subtemplate = self.reader.read(subtemplate_filename, self.paths)
+                subtemplate = self._read(subtemplate_filename)
                 extended_selection[template_key] = self._produce(
                     subtemplate, extended_selection, reference=template_key,
-                    check_produces=False)
+                    check_produces=False, cache=self._subtemplate_outputs)
 
             return template
         else:
             return mixed
 
-    def _extend(self, selection, named_chain, selection_index,
-                extensions=None):
+    def _read(self, filename):
+        if self._reads is not None:
+            self._reads.setdefault(self._current_node, set()).add(filename)
+        return self.reader.read(filename, self.paths)
+
+    def _extend(self, node_index, selection, selection_index):
         """Populates selection with reference to parent nodes in spec.
            Values are prefixed with _ for each level. Default extensions can
-           also be specified by the schema"""
-
-        expanded = {}
-        if not extensions is None:
-            expanded.update(extensions)
-
-        expanded.update({
-            "__mode__": self.mode,
-            "__index__": selection_index
-        })
-
-        expanded.update(selection)
-
-        prefix = "_"
-        for ancestor in reversed(named_chain):
-            for k, v in ancestor.iteritems():
-                expanded[prefix + k] = v
-            prefix += "_"
-        return expanded
+           also be specified by the schema. The values of the parent nodes
+           and the extensions are gathered once per expansion node."""
+        layers = self._node_layers.get(node_index)
+        if layers is None:
+            path, named_chain, pattern, node_path = \
+                self._expansion_nodes[node_index]
+            layers = NodeLayers(named_chain, self._leafs[path]["extensions"],
+                                self.mode, pattern)
+            self._node_layers[node_index] = layers
+        return layers.extend(selection, selection_index)
 
     def _permute_pattern(self, pattern):
-        for selection in self._permute(pattern, pattern.keys()):
-            yield selection
-
-    def _permute(self, pattern, key_order=[], key_index=0, selection=None):
-        if selection is None:
-            selection = {}
-
-        if key_index >= len(key_order):
-            yield selection
-            return
-
-        key = key_order[key_index]
-        for value in pattern[key]:
-            selection[key] = value
-            for next_selection in self._permute(pattern,
-                                                key_order,
-                                                key_index + 1,
-                                                selection):
-                yield next_selection
+        return iter(Expansion(pattern))
 
     def _as_assoc(self, mixed):
         if isinstance(mixed, dict):
@@ -245,11 +759,7 @@ class Generator(object):
         return path in self._leafs
 
     def _generalize_path(self, path):
-        parts = path.split('/')
-        for i in range(0, len(parts)):
-            if self._re_integer_pattern.match(parts[i]):
-                parts[i] = "*"
-        return '/' + '/'.join(filter(None, parts))
+        return self._paths.generalize(path)
 
     def _expand_pattern(self, pattern, generic_path):
         for k, v in pattern.iteritems():
@@ -262,9 +772,7 @@ class Generator(object):
         return pattern
 
     def _identify_path_actions(self, key, value, path="/"):
-        generic_path = self._generalize_path(path)
-
-        if "action" in value:
+        if isinstance(value, dict) and "action" in value:
             generic_path = self._generalize_path(path)
             self._path_action[generic_path] = value["action"]
             return
@@ -273,67 +781,267 @@ class Generator(object):
             return
 
         for k, v in self._as_assoc(value):
-            self._identify_path_actions(k, v, path + "/" + str(k))
+            self._identify_path_actions(k, v, self._paths.join(path, k))
+
+    def _classify(self, expansion_nodes):
+        """Splits the expansion nodes of a traversal into the suppress and
+           the generate nodes, keeping their order."""
+        nodes = {"suppress": [], "generate": []}
+        for expansion_node in expansion_nodes:
+            nodes[self._path_action[expansion_node[0]]].append(expansion_node)
+        return nodes["suppress"], nodes["generate"]
 
     def _traverse(self, key, value, path="/", named_chain=[],
-                  match_action=None):
-        generic_path = self._generalize_path(path)
+                  match_action=None, generic_path="/"):
+        """Yields the expansion nodes of the leafs under value whose action
+           is match_action, or of every suppress and generate leaf if it is
+           None."""
         if self._is_leaf(generic_path):
-            if self._path_action.get(generic_path, None) != match_action:
+            action = self._path_action.get(generic_path, None)
+            if not action in ("suppress", "generate") or \
+               (match_action is not None and action != match_action):
                 return
             expanded_pattern = self._expand_pattern(value, generic_path)
-            yield generic_path, named_chain, expanded_pattern
+            yield generic_path, named_chain, expanded_pattern, path
             return
 
         for k, v in self._as_assoc(value):
-            if not self._is_assoc(v):
-                continue
+            for expansion_node in self._traverse_child(k, v, path,
+                                                       generic_path,
+                                                       named_chain,
+                                                       match_action):
+                yield expansion_node
 
-            next_path = normalize_path(path + "/" + str(k))
-            next_generic_path = self._generalize_path(next_path)
+    def _traverse_child(self, key, value, path, generic_path, named_chain,
+                        match_action):
+        if not self._is_assoc(value):
+            return []
 
-            if "name" in v and not self._is_leaf(next_generic_path):
-                next_name = [v]
-            else:
-                next_name = []
+        # Paths are built from the parent's, the spec can be wide.
+        next_path = self._paths.child(path, key)
+        next_generic_path = self._paths.generic_child(generic_path, key)
 
-            for expansion_node in self._traverse(k, v, path=next_path,
-                                                 named_chain=named_chain + \
-                                                             next_name,
-                                                 match_action=match_action):
-                yield expansion_node
+        if "name" in value and not self._is_leaf(next_generic_path):
+            next_name = [value]
+        else:
+            next_name = []
 
-def run_generator(args):
-    import json, sys
-    # Grab the spec's and schema's path.
-    search_paths = {}
+        return self._traverse(key, value, path=next_path,
+                              named_chain=named_chain + next_name,
+                              match_action=match_action,
+                              generic_path=next_generic_path)
+
+def search_paths(args):
+    """Returns the directories of the spec and schema, which templates are
+       looked up in."""
+    paths = {}
     for filename in [args.spec, args.schema]:
         path = os.path.abspath(os.path.dirname(os.path.expanduser(filename)))
-        search_paths[path] = True
+        paths[path] = True
+    return paths.keys()
 
-    spec = load_json(args.spec)
+def run_generator(args):
+    import sys
+    if args.stream:
+        spec = StreamedSpec(args.spec)
+    else:
+        spec = load_json(args.spec)
     schema = load_json(args.schema)
-    writer = OutputWriter() if not args.dryrun else DryRunWritter()
-    reader = FileReader()
+    dependencies = None
+    if args.incremental and not args.dryrun:
+        dependencies = DependencyCache(args.incremental)
+    if not generate_once(args, spec, schema, search_paths(args),
+                         FileReader(), dependencies):
+        sys.exit(1)
+
+def generate_once(args, spec, schema, paths, reader, dependencies):
+    """Generates from the loaded spec and schema with the options given on
+       the command line, printing the reports. Returns whether it succeeded,
+       errors are printed."""
+    import json, sys
+    if args.dryrun:
+        writer = DryRunWritter()
+    elif args.output_archive:
+        try:
+            writer = ArchiveWriter(args.output_archive, dedup=args.dedup)
+        except (ValueError, IOError), err:
+            print 'Write Error:', err
+            sys.exit(1)
+    elif args.dedup:
+        writer = DedupWriter()
+    elif args.write_threads > 0:
+        writer = ThreadedWriter(threads=args.write_threads)
+    else:
+        writer = OutputWriter()
+    if args.manifest and not args.dryrun:
+        writer = ManifestWriter(writer, args.manifest, prune=args.prune)
+    if args.shard and not args.dryrun:
+        shard_manifest = args.shard_manifest or \
+                         ".testgen-shard-%d-of-%d.json" % args.shard
+        # Taken before the spec gets expanded in place.
+        writer = ShardWriter(writer, shard_manifest, args.shard,
+                             digest(spec, schema))
+    events = open(args.events, "w") if args.events else None
+    reporter = Reporter(level=LEVELS.index(args.log_level),
+                        progress_stream=sys.stderr if sys.stderr.isatty()
+                                        else None,
+                        events=events)
     generator = Generator(spec, schema,
                           writer=writer,
                           reader=reader,
                           mode=args.target,
-                          paths=search_paths.keys())
+                          paths=paths,
+                          jobs=args.jobs,
+                          dependencies=dependencies,
+                          reporter=reporter,
+                          file_check_threads=args.file_check_threads,
+                          shard=args.shard)
+    profiler = None
+    if args.profile:
+        profiler = Profiler()
+        profiler.instrument(generator)
     error_details = {}
+    closed = False
     try:
+        if args.plan or args.max_outputs is not None or \
+           args.max_bytes is not None:
+            plan = generator.plan(error_details=error_details)
+            if args.plan:
+                print plan.format()
+                return True
+            plan.check_budget(max_outputs=args.max_outputs,
+                              max_bytes=args.max_bytes)
         generator.generate(error_details=error_details)
-        return
+        writer.close()
+        closed = True
+        if isinstance(writer, ShardWriter):
+            writer.save(generator.selection_range, generator.selection_count)
+            print writer.report()
+            writer = writer.writer
+        if isinstance(writer, ManifestWriter):
+            print writer.report()
+            writer = writer.writer
+        if isinstance(writer, (DedupWriter, ArchiveWriter)):
+            print writer.report()
+        if dependencies is not None:
+            dependencies.save()
+            print dependencies.report()
+        if profiler is not None:
+            profiler.finish()
+            profiler.save(args.profile)
+            print profiler.format()
+        return True
     except SchemaError, err:
         print 'Schema Error:', err.message
     except SpecError, err:
         print 'Spec Error:', err.message
         print json.dumps(error_details, indent=2)
+    except StreamError, err:
+        print 'Spec Error:', err.message
+    except BudgetError, err:
+        print plan.format()
+        print 'Budget Error:', err.message
+    except ReadError, err:
+        print 'Read Error:', err
+    except (IOError, OSError), err:
+        print 'Write Error:', err
+    finally:
+        if not closed:
+            # Stops the writer threads and drops a partly written archive.
+            writer.abort()
+        if events is not None:
+            events.close()
+
+    return False
 
-    sys.exit(1)
+def watch_generator(args, watcher=None, cycles=None):
+    """Generates, then again each time the spec, the schema or a template
+       which was read changes, until interrupted or after the given number
+       of cycles.
+
+       The parsed spec is reused until its file changes, and so are the
+       compiled schema and the template contents. The dependency records of
+       the previous cycle are kept, so only the expansion nodes whose inputs
+       changed are rendered again. Each cycle reports how long it took."""
+    import sys, time
+    if watcher is None:
+        watcher = Watcher(interval=args.watch)
+    paths = search_paths(args)
+    reader = FileReader()
+    dependencies = None
+    if not args.dryrun:
+        dependencies = DependencyCache(args.incremental)
+    loaded = {}
+    cycle = 0
+    changed = []
+    try:
+        while cycles is None or cycle < cycles:
+            cycle += 1
+            start = time.time()
+            clear_file_exists_cache()
+            reader.read_signatures.clear()
+            inputs = {}
+            succeeded = None
+            spec = schema = None
+            try:
+                spec = _load_changed(args.spec, loaded, inputs)
+                schema = _load_changed(args.schema, loaded, inputs,
+                                       compiler=CompiledSchema)
+            except SystemExit:
+                # The JSON error is printed, waiting for it to be fixed.
+                pass
+            except (IOError, OSError), err:
+                print 'Read Error:', err
+            except SchemaError, err:
+                print 'Schema Error:', err.message
+            except SpecError, err:
+                print 'Spec Error:', err.message
+            if spec is not None and schema is not None:
+                # The generator expands the spec in place.
+                succeeded = generate_once(args, copy.deepcopy(spec), schema,
+                                          paths, reader, dependencies)
+            if dependencies is not None and succeeded is not None:
+                if succeeded:
+                    dependencies.restart()
+                else:
+                    dependencies.forget()
+            print "Cycle %d %s in %.3fs%s" % \
+                  (cycle, "done" if succeeded else "failed",
+                   time.time() - start,
+                   ", after changes to " + ", ".join(changed) if changed
+                   else "")
+            sys.stdout.flush()
+            if cycles is not None and cycle >= cycles:
+                break
+            files = dict(reader.read_signatures)
+            files.update(inputs)
+            watcher.watch(files)
+            changed = [os.path.relpath(path) for path in watcher.wait()]
+    except KeyboardInterrupt:
+        print
+
+def _load_changed(filename, loaded, inputs, compiler=None):
+    """Returns the JSON of the file, only loading (and compiling) it again
+       when it changed. Records the signature it is loaded at in inputs."""
+    path = os.path.abspath(os.path.expanduser(filename))
+    current = signature(path)
+    inputs[path] = current
+    if not path in loaded or loaded[path][0] != current:
+        content = load_json(path)
+        if compiler is not None:
+            content = compiler(content)
+        loaded[path] = (current, content)
+    return loaded[path][1]
 
 def main():
     import argparse
+
+    def shard(text):
+        try:
+            return parse_shard(text)
+        except ValueError, err:
+            raise argparse.ArgumentTypeError(err.message)
+
     parser = argparse.ArgumentParser(description='TestGen generator utility')
     # TODO(kristijanburnik): Merge as common options.
     parser.add_argument('-s', '--spec', type=str, required=True,
@@ -347,8 +1055,88 @@ def main():
     parser.add_argument('-t', '--target', type = str,
         choices = ("release", "debug"), default = "release",
         help = 'Sets the appropriate mode for generating tests')
+    parser.add_argument('--log-level', choices=LEVELS,
+        default=LEVELS[SUMMARY],
+        help='How much to print: nothing, a summary, a line per expansion '
+             'pattern or a line per selection')
+    parser.add_argument('-q', '--quiet', dest='log_level',
+        action='store_const', const=LEVELS[QUIET],
+        help='Same as --log-level=quiet')
+    parser.add_argument('--events', default=None,
+        help='Writes the progress as JSON events, one per line, to the file')
+    parser.add_argument('--profile', nargs='?', default=None,
+        const='.testgen-profile.json',
+        help='Measures the time, calls and memory of each phase and schema '
+             'leaf, writing a JSON report to the file')
+    parser.add_argument('--file-check-threads', type=int, default=0,
+        help='Checks that the files referenced by the spec exist on this '
+             'many threads')
+    parser.add_argument('--plan', action='store_true', default=False,
+        help='Displays how many selections and files each leaf will '
+             'generate without generating them')
+    parser.add_argument('--max-outputs', type=int, default=None,
+        help='Aborts before generating if more files are estimated')
+    parser.add_argument('--max-bytes', type=int, default=None,
+        help='Aborts before generating if more bytes are estimated')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+        help='Number of processes rendering the tests in parallel')
+    parser.add_argument('--write-threads', type=int, default=0,
+        help='Number of threads writing the generated files')
+    parser.add_argument('--manifest', type=str, nargs='?',
+        const='.testgen-manifest.json', default=None,
+        help='Keeps a manifest of output content hashes and skips rewriting '
+             'unchanged files')
+    parser.add_argument('--prune', action='store_true', default=False,
+        help='Removes files of the previous manifest which were not '
+             'generated by this run')
+    parser.add_argument('--incremental', type=str, nargs='?',
+        const='.testgen-deps.json', default=None,
+        help='Records what each output is generated from and only '
+             'regenerates outputs whose inputs changed')
+    parser.add_argument('--stream', action='store_true', default=False,
+        help='Reads the top-level arrays of the spec entry by entry instead '
+             'of loading the whole spec in memory')
+    parser.add_argument('--shard', type=shard, default=None,
+        help='Generates only the i-th of N equal blocks of the selections, '
+             'as i/N counting from 0, and writes a shard manifest')
+    parser.add_argument('--shard-manifest', default=None,
+        help='File of the shard manifest, .testgen-shard-i-of-N.json by '
+             'default')
+    parser.add_argument('--output-archive', default=None,
+        help='Writes the outputs into a .tar, .tar.gz, .tar.bz2, .tar.xz or '
+             '.zip archive instead of files')
+    parser.add_argument('--dedup', action='store_true', default=False,
+        help='Writes each distinct content once, files with the same '
+             'content become hard links to it')
+    parser.add_argument('--watch', type=float, nargs='?', const=0.5,
+        default=None, metavar='SECONDS',
+        help='Keeps running and generates again whenever the spec, the '
+             'schema or a template changes, polling every SECONDS')
     args = parser.parse_args()
-    run_generator(args)
+    if args.watch is not None and args.watch <= 0:
+        parser.error('--watch needs a positive number of seconds')
+    if args.watch is not None and (args.stream or args.shard or
+                                   args.output_archive or args.plan or
+                                   args.jobs > 1):
+        parser.error('--watch does not support --stream, --shard, '
+                     '--output-archive, --plan or --jobs')
+    if args.dedup and args.write_threads > 0:
+        parser.error('--dedup does not support --write-threads')
+    if args.output_archive and (args.manifest or args.incremental or
+                                args.write_threads > 0):
+        parser.error('--output-archive does not support --manifest, '
+                     '--incremental or --write-threads')
+    if args.shard and (args.stream or args.incremental):
+        parser.error('--shard does not support --stream or --incremental')
+    if args.stream and (args.jobs > 1 or args.incremental or args.plan or
+                        args.max_outputs is not None or
+                        args.max_bytes is not None):
+        parser.error('--stream does not support --jobs, --incremental, '
+                     '--plan, --max-outputs or --max-bytes')
+    if args.watch is not None:
+        watch_generator(args)
+    else:
+        run_generator(args)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,84 @@
+import hashlib
+import json
+import os
+
+def digest(*parts):
+    """Returns a stable digest of JSON serializable parts."""
+    serialized = json.dumps(parts, sort_keys=True, default=repr)
+    return hashlib.sha1(serialized).hexdigest()
+
+class DependencyCache(object):
+    """Records what the outputs of each expansion node were produced from.
+
+       A record is kept per concrete spec path of the expansion node and
+       holds the digest of its inputs (leaf schema, pattern, referenced
+       ancestor values, selection index offset, suppression), the keys its
+       templates reference, the digests of the template files it read and
+       the outputs it produced. A node whose record still matches does not
+       need to be rendered again.
+
+       Without a path the records are only kept in memory, for the runs of
+       one process, see restart()."""
+
+    def __init__(self, path):
+        self.path = path
+        self.reused = 0
+        self.rendered = 0
+        self._previous = self._load()
+        self._records = {}
+
+    def _load(self):
+        if self.path is None or not os.path.isfile(self.path):
+            return {}
+        with open(self.path) as f:
+            try:
+                return json.load(f)["nodes"]
+            except (ValueError, KeyError, TypeError):
+                return {}
+
+    def previous(self, node_path):
+        return self._previous.get(node_path)
+
+    def previous_outputs(self, node_path):
+        record = self._previous.get(node_path)
+        return record["outputs"] if record is not None else []
+
+    def node_paths(self):
+        return self._previous.keys()
+
+    def reuse(self, node_path):
+        self._records[node_path] = self._previous[node_path]
+        self.reused += 1
+
+    def record(self, node_path, node_digest, keys, templates, outputs):
+        self._records[node_path] = {"digest": node_digest,
+                                    "keys": sorted(keys),
+                                    "templates": templates,
+                                    "outputs": outputs}
+        self.rendered += 1
+
+    def restart(self):
+        """Starts another run which reuses the records of this one."""
+        self._previous = self._records
+        self._records = {}
+        self.reused = 0
+        self.rendered = 0
+
+    def forget(self):
+        """Starts another run which renders every node, after a run which
+           failed part way and may have left outputs its records do not
+           describe."""
+        self._previous = {}
+        self._records = {}
+        self.reused = 0
+        self.rendered = 0
+
+    def save(self):
+        if self.path is None:
+            return
+        with open(self.path, "w") as f:
+            json.dump({"nodes": self._records}, f, indent=0, sort_keys=True)
+
+    def report(self):
+        return "Reused %d of %d expansion nodes" % \
+               (self.reused, self.reused + self.rendered)
@@ -0,0 +1,77 @@
+from util import format_table
+
+class BudgetError(Exception):
+    """Error raised when a generation plan exceeds a budget."""
+    pass
+
+def _size(content):
+    if isinstance(content, unicode):
+        return len(content.encode("utf-8"))
+    return len(content)
+
+class LeafPlan(object):
+    """Cardinalities of the selections and estimated outputs of a leaf."""
+
+    def __init__(self, path):
+        self.path = path
+        self.nodes = 0
+        self.combinations = 0
+        self.suppressed = 0
+        self.outputs = 0
+        self.bytes = 0
+
+    @property
+    def selections(self):
+        return self.combinations - self.suppressed
+
+class Plan(object):
+    """What a generation run is going to produce.
+
+       The selection counts are exact. The outputs and bytes are estimated
+       from one rendered sample selection per expansion node."""
+
+    def __init__(self):
+        self.leafs = []
+        self._leaf_map = {}
+
+    def add_node(self, path, combinations, suppressed, sample_outputs):
+        if not path in self._leaf_map:
+            self._leaf_map[path] = LeafPlan(path)
+            self.leafs.append(self._leaf_map[path])
+        leaf = self._leaf_map[path]
+        selections = combinations - suppressed
+        leaf.nodes += 1
+        leaf.combinations += combinations
+        leaf.suppressed += suppressed
+        leaf.outputs += selections * len(sample_outputs)
+        leaf.bytes += selections * sum([_size(content)
+                                        for file_path, content
+                                        in sample_outputs])
+
+    def total(self):
+        total = LeafPlan("Total")
+        for leaf in self.leafs:
+            for field in ["nodes", "combinations", "suppressed", "outputs",
+                          "bytes"]:
+                setattr(total, field,
+                        getattr(total, field) + getattr(leaf, field))
+        return total
+
+    def check_budget(self, max_outputs=None, max_bytes=None):
+        total = self.total()
+        if max_outputs is not None and total.outputs > max_outputs:
+            raise BudgetError("Estimated %d outputs exceed the budget of %d" % \
+                              (total.outputs, max_outputs))
+        if max_bytes is not None and total.bytes > max_bytes:
+            raise BudgetError("Estimated %d bytes exceed the budget of %d" % \
+                              (total.bytes, max_bytes))
+
+    def format(self):
+        header = ("Leaf", "Nodes", "Combinations", "Suppressed", "Selections",
+                  "~Outputs", "~Bytes")
+        rows = [header]
+        for leaf in self.leafs + [self.total()]:
+            rows.append((leaf.path, str(leaf.nodes), str(leaf.combinations),
+                         str(leaf.suppressed), str(leaf.selections),
+                         str(leaf.outputs), str(leaf.bytes)))
+        return format_table(rows)
@@ -0,0 +1,178 @@
+from util import format_table
+import json
+import os
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+PHASES = ["validate", "traverse", "expand", "render", "write"]
+
+def _cpu_time():
+    if resource is not None:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime
+    times = os.times()
+    return times[0] + times[1]
+
+class PhaseStats(object):
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.peak_memory = 0
+
+    def as_dict(self):
+        return {"calls": self.calls, "wall": self.wall, "cpu": self.cpu,
+                "peak_memory": self.peak_memory}
+
+class Profiler(object):
+    """Measures the phases of a generation run per schema leaf path.
+
+       The generator is instrumented by replacing the methods of the phases
+       on the instance, so nothing is measured, and nothing costs, unless a
+       profiler is attached. Wall and CPU time are summed over the calls of
+       each phase, generators are timed while they produce their items only.
+       The peak memory is the highest peak seen when a phase call ended, as
+       traced by tracemalloc where available, otherwise the peak resident set
+       size of the process.
+
+       With several jobs rendering happens in the worker processes and is
+       not measured."""
+
+    def __init__(self):
+        self.phases = {}
+        self.leafs = {}
+        self.memory_source = "tracemalloc" if tracemalloc is not None \
+                             else "ru_maxrss" if resource is not None \
+                             else None
+        self._active = set()
+        self._tracing = False
+
+    def instrument(self, generator):
+        if tracemalloc is not None and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+
+        def node_leaf(node_index, *args, **kwargs):
+            return generator._expansion_nodes[node_index][0]
+
+        def current_leaf(*args, **kwargs):
+            if generator._current_node is None:
+                return None
+            return generator._expansion_nodes[generator._current_node][0]
+
+        self._wrap(generator, "_validate", "validate")
+        self._wrap(generator, "_traverse", "traverse", iterates=True)
+        self._wrap(generator, "_select_node", "expand", leaf_of=node_leaf,
+                   iterates=True)
+        self._wrap(generator, "_render", "render", leaf_of=node_leaf)
+        self._wrap(generator.writer, "write", "write", leaf_of=current_leaf)
+        if hasattr(generator.writer, "close"):
+            self._wrap(generator.writer, "close", "write")
+
+    def finish(self):
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+
+    def _wrap(self, owner, name, phase, leaf_of=None, iterates=False):
+        function = getattr(owner, name)
+        profiler = self
+
+        def measured(*args, **kwargs):
+            if phase in profiler._active:
+                # Recursive calls are part of the outermost one.
+                return function(*args, **kwargs)
+            leaf = leaf_of(*args, **kwargs) if leaf_of is not None else None
+            if iterates:
+                return profiler._iterate(phase, leaf,
+                                         function(*args, **kwargs))
+            started = profiler._start(phase)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profiler._stop(phase, leaf, started, call=True)
+
+        setattr(owner, name, measured)
+
+    def _iterate(self, phase, leaf, iterator):
+        call = True
+        while True:
+            started = self._start(phase)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._stop(phase, leaf, started, call=call)
+                call = False
+            yield item
+
+    def _start(self, phase):
+        self._active.add(phase)
+        return time.time(), _cpu_time()
+
+    def _stop(self, phase, leaf, started, call):
+        wall = time.time() - started[0]
+        cpu = _cpu_time() - started[1]
+        self._active.discard(phase)
+        memory = self._peak_memory()
+        records = [self.phases.setdefault(phase, PhaseStats())]
+        if leaf is not None:
+            records.append(self.leafs.setdefault(leaf, {}).setdefault(
+                phase, PhaseStats()))
+        for stats in records:
+            if call:
+                stats.calls += 1
+            stats.wall += wall
+            stats.cpu += cpu
+            stats.peak_memory = max(stats.peak_memory, memory)
+
+    def _peak_memory(self):
+        if self._tracing:
+            return tracemalloc.get_traced_memory()[1]
+        if resource is not None:
+            # Kilobytes on Linux.
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return 0
+
+    def report(self):
+        return {"memory": self.memory_source,
+                "phases": dict([(phase, stats.as_dict())
+                                for phase, stats in self.phases.iteritems()]),
+                "leafs": dict([(leaf, dict([(phase, stats.as_dict())
+                                            for phase, stats
+                                            in phases.iteritems()]))
+                               for leaf, phases in self.leafs.iteritems()])}
+
+    def save(self, filename):
+        with open(filename, "w") as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+
+    def format(self):
+        rows = [("Phase", "Calls", "Wall (s)", "CPU (s)", "Peak memory")]
+        for phase in PHASES:
+            if phase in self.phases:
+                stats = self.phases[phase]
+                rows.append((phase, str(stats.calls), "%.3f" % stats.wall,
+                             "%.3f" % stats.cpu,
+                             "%d KiB" % (stats.peak_memory / 1024)))
+        lines = [format_table(rows)]
+
+        if self.leafs:
+            rows = [["Leaf"] + ["%s (s)" % phase for phase in PHASES]]
+            for leaf in sorted(self.leafs.keys()):
+                phases = self.leafs[leaf]
+                rows.append([leaf] + ["%.3f" % phases[phase].wall
+                                      if phase in phases else "-"
+                                      for phase in PHASES])
+            lines.append(format_table(rows))
+        return "\n\n".join(lines)
@@ -0,0 +1,133 @@
+import json
+import sys
+import time
+
+QUIET, SUMMARY, VERBOSE, TRACE = range(0, 4)
+LEVELS = ["quiet", "summary", "verbose", "trace"]
+
+class Reporter(object):
+    """Reports the progress of a generation run.
+
+       quiet prints nothing, summary prints a line when the run finishes,
+       verbose adds a line per expansion node and trace adds a line per
+       selection. A progress line with the selection rate and the ETA is kept
+       up to date on the progress stream, if one is given, and the same
+       reports can be streamed as JSON events, one per line.
+
+       The generator only calls progress() every check_interval selections
+       and selection() when tracing, so the default costs nearly nothing per
+       selection."""
+
+    check_interval = 1024
+
+    def __init__(self, level=SUMMARY, stream=None, progress_stream=None,
+                 events=None, interval=0.5, clock=time.time):
+        self.level = level
+        self.tracing = level >= TRACE
+        self.stream = stream if not stream is None else sys.stdout
+        self.progress_stream = progress_stream
+        self.events = events
+        self.interval = interval
+        self.clock = clock
+        self.generated = 0
+        self.excluded = 0
+        self.reused = 0
+        self.outputs = 0
+        self._combinations = 0
+        self._started = None
+        self._last_progress = None
+        self._progress_width = 0
+
+    def suppress(self, pattern):
+        if self.tracing:
+            self._print("To be excluded", pattern)
+            self._event("suppress", pattern=pattern)
+
+    def start(self, nodes, combinations):
+        self.generated = 0
+        self.excluded = 0
+        self.reused = 0
+        self.outputs = 0
+        self._combinations = combinations
+        self._started = self._last_progress = self.clock()
+        self._event("start", nodes=nodes, combinations=combinations)
+
+    def selection(self, action, selection_index, selection):
+        """Reports a single selection, only called when tracing."""
+        self._print("Generating" if action == "generate" else "Excluding",
+                    selection)
+        self._event("selection", action=action, index=selection_index,
+                    selection=selection)
+
+    def progress(self, done, pending=0):
+        """Reports that done of the combinations have been gone through and
+           pending selections of the current node were generated so far."""
+        now = self.clock()
+        if now - self._last_progress < self.interval:
+            return
+        self._last_progress = now
+        elapsed = now - self._started
+        generated = self.generated + pending
+        rate = generated / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if done > 0 and self._combinations > done:
+            eta = elapsed * (self._combinations - done) / done
+        if self.progress_stream is not None and self.level >= SUMMARY:
+            line = "%d/%d combinations, %d selections, %.0f selections/s" % \
+                   (done, self._combinations, generated, rate)
+            if eta is not None:
+                line += ", ETA %.0fs" % eta
+            self._progress_width = max(self._progress_width, len(line))
+            self.progress_stream.write("\r" + line.ljust(self._progress_width))
+            self.progress_stream.flush()
+        self._event("progress", done=done, combinations=self._combinations,
+                    generated=generated, rate=rate, eta=eta)
+
+    def node(self, path, node_path, combinations, generated, reused=False):
+        if reused:
+            self.reused += 1
+        else:
+            self.generated += generated
+            self.excluded += combinations - generated
+        if self.level >= VERBOSE:
+            if reused:
+                self._print("Reused %s (%s)" % (node_path, path))
+            else:
+                self._print("Generated %d of %d selections of %s (%s)" % \
+                            (generated, combinations, node_path, path))
+        self._event("node", path=path, node_path=node_path,
+                    combinations=combinations, generated=generated,
+                    reused=reused)
+
+    def finish(self, outputs):
+        self.outputs = outputs
+        elapsed = self.clock() - self._started
+        rate = self.generated / elapsed if elapsed > 0 else 0.0
+        self._clear_progress()
+        if self.level >= SUMMARY:
+            self._print("Generated %d selections (%d excluded) into %d "
+                        "outputs in %.2fs, %.0f selections/s" % \
+                        (self.generated, self.excluded, outputs, elapsed,
+                         rate))
+        self._event("finish", generated=self.generated,
+                    excluded=self.excluded, reused=self.reused,
+                    outputs=outputs, elapsed=elapsed)
+
+    def _clear_progress(self):
+        if self._progress_width and self.progress_stream is not None:
+            self.progress_stream.write("\r" + " " * self._progress_width +
+                                       "\r")
+            self.progress_stream.flush()
+            self._progress_width = 0
+
+    def _print(self, *parts):
+        self.stream.write(" ".join([part if isinstance(part, basestring)
+                                    else str(part) for part in parts]) + "\n")
+
+    def _event(self, event, **fields):
+        if self.events is None:
+            return
+        fields["event"] = event
+        fields["time"] = self.clock()
+        self.events.write(json.dumps(fields, sort_keys=True, default=repr) +
+                          "\n")
@@ -0,0 +1,327 @@
+from util import filter_comments
+from expansion import Expansion
+from template import holds_strings
+from operator import itemgetter
+import json
+
+def canonical_keys(pattern):
+    """Returns the keys identifying a selection of the pattern in a fixed
+       order. The name, description and __ prefixed keys are left out."""
+    # TODO(kristijanburnik): Omitting names is a hack. It should be
+    # documented or there should be a way to specify which patterns match.
+    return tuple(sorted(filter_comments(pattern).keys()))
+
+def _product(value_lists):
+    count = 1
+    for values in value_lists:
+        count *= len(values)
+    return count
+
+class ValueInterner(object):
+    """Maps selection values to small integer ids. Values other than strings
+       are told apart by type as well, 1, 1.0 and True get different ids."""
+
+    def __init__(self):
+        self._ids = {}
+        self._values = []
+
+    def _key(self, value):
+        if isinstance(value, basestring):
+            return value
+        try:
+            hash(value)
+        except TypeError:
+            return (type(value), json.dumps(value, sort_keys=True,
+                                            default=repr))
+        return (type(value), value)
+
+    def intern(self, value):
+        key = self._key(value)
+        try:
+            return self._ids[key]
+        except KeyError:
+            value_id = len(self._values)
+            self._ids[key] = value_id
+            self._values.append(value)
+            return value_id
+
+    def value(self, value_id):
+        return self._values[value_id]
+
+    def __len__(self):
+        return len(self._values)
+
+class SelectionIdentity(object):
+    """Builds the canonical identity of selections expanded from a pattern.
+
+       The identity is a tuple of interned value ids in canonical key order,
+       so two selections compare equal regardless of dict ordering and
+       without serializing them."""
+
+    def __init__(self, interner, pattern):
+        self.keys = canonical_keys(pattern)
+        self._intern = interner.intern
+
+    def key(self, selection):
+        intern = self._intern
+        return tuple([intern(selection[k]) for k in self.keys])
+
+    def indexed(self, expansion):
+        """Returns a function building the identity from the index tuples of
+           the expansion, so selections need not be built to be identified."""
+        positions = [expansion.keys.index(k) for k in self.keys]
+        lookups = [(position,
+                    [self._intern(value)
+                     for value in expansion.value_lists[position]])
+                   for position in positions]
+        def key(indices):
+            return tuple([value_ids[indices[position]]
+                          for position, value_ids in lookups])
+        return key
+
+class _TooMuchOverlap(Exception):
+    pass
+
+class SuppressionMatcher(object):
+    """Matches selections against suppress patterns without expanding them.
+
+       Each pattern is indexed by its canonical keys as per-key sets of
+       allowed value ids, so memory is proportional to the size of the
+       patterns rather than to the number of selections they expand into."""
+
+    def __init__(self, interner=None):
+        self.interner = interner if not interner is None else ValueInterner()
+        self._patterns = {}
+
+    def add(self, pattern):
+        keys = canonical_keys(pattern)
+        allowed = tuple([self._intern_all(pattern[k]) for k in keys])
+        patterns = self._patterns.setdefault(keys, [])
+        if not allowed in patterns:
+            patterns.append(allowed)
+
+    def __len__(self):
+        return sum([len(patterns) for patterns in self._patterns.values()])
+
+    def identity(self, pattern):
+        return SelectionIdentity(self.interner, pattern)
+
+    def restrict(self, pattern):
+        """Returns the rules relevant for selections expanded from the pattern.
+
+           Each rule is a list of (position, allowed value ids) checks against
+           the selection identity, keys which all of the pattern's values
+           satisfy are left out. An empty rule means every selection of the
+           pattern is suppressed, no rules means none is."""
+        keys = canonical_keys(pattern)
+        value_ids = [self._intern_all(pattern[k]) for k in keys]
+        rules = []
+        for allowed in self._patterns.get(keys, []):
+            checks = []
+            for position in range(0, len(keys)):
+                matching = value_ids[position] & allowed[position]
+                if len(matching) == 0:
+                    checks = None
+                    break
+                if len(matching) < len(value_ids[position]):
+                    checks.append((position, allowed[position]))
+            if checks is None:
+                continue
+            if len(checks) == 0:
+                return [[]]
+            rules.append(checks)
+        return rules
+
+    def count(self, pattern):
+        """Counts the selections of the pattern matched by suppress patterns
+           without expanding either of them."""
+        keys = canonical_keys(pattern)
+        box = [[self.interner.intern(value) for value in pattern[k]]
+               for k in keys]
+        overlapping = [allowed for allowed in self._patterns.get(keys, [])
+                       if _product([[value for value in values
+                                     if value in allowed[position]]
+                                    for position, values in enumerate(box)])]
+        unmatched = 1
+        for key, values in pattern.iteritems():
+            if not key in keys:
+                unmatched *= len(values)
+        # The position from which on each pattern allows all of the box.
+        covering = []
+        for allowed in overlapping:
+            position = len(box)
+            while position > 0 and \
+                  set(box[position - 1]) <= allowed[position - 1]:
+                position -= 1
+            covering.append(position)
+        # Heavily overlapping patterns split the values into about as many
+        # classes as there are combinations. The work grows with the patterns
+        # in play, past a few times the number of combinations the selections
+        # are matched one by one instead.
+        budget = [_product(box) * 2]
+        try:
+            covered = self._count_covered(box, overlapping, covering,
+                                          tuple(range(0, len(overlapping))),
+                                          0, {}, budget)
+        except _TooMuchOverlap:
+            covered = self._count_matched(dict([(k, pattern[k])
+                                                for k in keys]))
+        return covered * unmatched
+
+    def _count_matched(self, pattern):
+        rules = self.restrict(pattern)
+        expansion = Expansion(pattern)
+        key = self.identity(pattern).indexed(expansion)
+        matched = 0
+        for indices in expansion.indices():
+            if self.matches_key(key(indices), rules):
+                matched += 1
+        return matched
+
+    def _count_covered(self, box, patterns, covering, active, position, memo,
+                       budget):
+        # Counts the combinations of box[position:] matched by any of the
+        # active patterns, which all match the values taken before position.
+        # Values of a key which the same patterns allow are counted together,
+        # so this takes at most one call per combination of such classes.
+        if not active:
+            return 0
+        budget[0] -= len(active)
+        if budget[0] < 0:
+            raise _TooMuchOverlap()
+        memo_key = (position, active)
+        if memo_key in memo:
+            return memo[memo_key]
+        for index in active:
+            if covering[index] <= position:
+                memo[memo_key] = _product(box[position:])
+                return memo[memo_key]
+        classes = {}
+        for value in box[position]:
+            allowing = tuple([index for index in active
+                              if value in patterns[index][position]])
+            classes[allowing] = classes.get(allowing, 0) + 1
+        covered = 0
+        for allowing, size in classes.iteritems():
+            covered += size * self._count_covered(box, patterns, covering,
+                                                  allowing, position + 1,
+                                                  memo, budget)
+        memo[memo_key] = covered
+        return covered
+
+    def describe(self, pattern, rules):
+        """Returns a stable, serializable form of the pattern's rules."""
+        keys = canonical_keys(pattern)
+        description = []
+        for checks in rules:
+            description.append([(keys[position],
+                                 sorted([repr(self.interner.value(value_id))
+                                         for value_id in allowed]))
+                                for position, allowed in checks])
+        return description
+
+    def matches(self, selection):
+        """Tells whether the selection is matched by any suppress pattern."""
+        pattern = {}
+        for key, value in selection.iteritems():
+            pattern[key] = [value]
+        return len(self.restrict(pattern)) > 0
+
+    def matches_key(self, selection_key, rules):
+        """Tells whether the selection identity is matched by any rule."""
+        for checks in rules:
+            for position, allowed in checks:
+                if not selection_key[position] in allowed:
+                    break
+            else:
+                return True
+        return False
+
+    def _intern_all(self, values):
+        return frozenset([self.interner.intern(value) for value in values])
+
+class NodeLayers(object):
+    """The values shared by the selections of an expansion node. Values of
+       the named ancestors, prefixed with _ per level up, take precedence
+       over the selection, the extensions and __mode__ do not."""
+
+    def __init__(self, named_chain, extensions, mode, keys):
+        ancestors = {}
+        prefix = "_"
+        for ancestor in reversed(named_chain):
+            for k, v in ancestor.iteritems():
+                ancestors[prefix + k] = v
+            prefix += "_"
+        self.shared = dict(extensions or {})
+        self.shared["__mode__"] = mode
+        self.shared.update(ancestors)
+        # Ancestor values which hide keys of the selection itself.
+        self._hiding = [(k, v) for k, v in ancestors.iteritems()
+                        if k in keys or k == "__index__"]
+
+    def extend(self, selection, selection_index):
+        """Returns a new dict of the values of the selection. Writing to it
+           leaves the shared values alone."""
+        extended = dict(self.shared)
+        extended["__index__"] = selection_index
+        extended.update(selection)
+        if self._hiding:
+            extended.update(self._hiding)
+        return extended
+
+class WhenCondition(object):
+    """The match_any clauses of a when rule as pairs of compiled templates.
+       Pairs decided by the templates alone are folded, the outcome of the
+       others is remembered per tuple of the string values they reference."""
+
+    memo_limit = 4096
+
+    def __init__(self, clauses):
+        self.always = False
+        self._clauses = []
+        keys = set()
+        memoizable = True
+        for first, second in clauses:
+            if first.source == second.source or \
+               first.is_constant and second.is_constant and \
+               first.render({}) == second.render({}):
+                self.always = True
+            elif first.is_constant and second.is_constant:
+                continue
+            else:
+                self._clauses.append((first.render, second.render))
+                keys.update(first.keys | second.keys)
+                memoizable = memoizable and first.formats_strings and \
+                             second.formats_strings
+        if self.always:
+            self._clauses = []
+        self.never = not self.always and not self._clauses
+        self.keys = tuple(sorted(keys))
+        self._memo = None
+        if self._clauses and self.keys and memoizable and \
+           not "__index__" in keys:
+            self._memo = {}
+            self._key = itemgetter(*self.keys)
+
+    def matches(self, values):
+        if self._memo is None:
+            return self.always or self._evaluate(values)
+        key = self._key(values)
+        try:
+            return self._memo[key]
+        except KeyError:
+            pass
+        except TypeError:
+            return self._evaluate(values)
+        result = self._evaluate(values)
+        if holds_strings(key, len(self.keys)):
+            if len(self._memo) >= self.memo_limit:
+                self._memo.clear()
+            self._memo[key] = result
+        return result
+
+    def _evaluate(self, values):
+        for first, second in self._clauses:
+            if first(values) == second(values):
+                return True
+        return False
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+from util import content_digest
+import json
+import sys
+
+class ShardError(Exception):
+    """Error raised when shard manifests do not add up to a whole run."""
+    pass
+
+def parse_shard(text):
+    """Parses "i/N" into (i, N). Shards are numbered from 0."""
+    try:
+        index, count = [int(part) for part in text.split("/")]
+    except ValueError:
+        raise ValueError("Shard must be given as i/N: %s" % text)
+    if count < 1 or index < 0 or index >= count:
+        raise ValueError("Shard %s is out of range, i must be in [0, N)" %
+                         text)
+    return index, count
+
+def shard_range(index, count, total):
+    """Returns the [start, stop) range of the selection indices of a shard.
+       The ranges of the shards follow each other and their sizes differ by
+       one at most."""
+    return total * index // count, total * (index + 1) // count
+
+class ShardWriter(object):
+    """Records the files a shard writes into a shard manifest.
+
+       The manifest holds the shard, the range of selection indices it
+       generated out of all of them, a digest of the spec and schema and the
+       content digest of every file written, for merge_shards() to check."""
+
+    def __init__(self, writer, manifest_path, shard, inputs):
+        self.writer = writer
+        self.manifest_path = manifest_path
+        self.shard = shard
+        self.inputs = inputs
+        self._files = {}
+
+    def write(self, filename, content):
+        self.writer.write(filename, content)
+        self._files[filename] = content_digest(content)
+
+    def close(self):
+        self.writer.close()
+
+    def abort(self):
+        self.writer.abort()
+
+    def save(self, selection_range, selection_count):
+        with open(self.manifest_path, "w") as f:
+            json.dump({"shard": self.shard[0],
+                       "shards": self.shard[1],
+                       "range": list(selection_range),
+                       "selections": selection_count,
+                       "inputs": self.inputs,
+                       "files": self._files}, f, indent=0, sort_keys=True)
+
+    def report(self):
+        return "Shard %d/%d: %d files" % (self.shard[0], self.shard[1],
+                                          len(self._files))
+
+def merge_shards(manifests):
+    """Checks that the shard manifests cover one whole run and returns its
+       files as a dict of path to (content digest, shard index).
+
+       All shards of the same inputs have to be given once. A path written
+       by several shards is taken from the last of them, the same file wins
+       as in an unsharded run."""
+    if not manifests:
+        raise ShardError("No shard manifests given")
+    first = manifests[0]
+    count = first["shards"]
+    total = first["selections"]
+    problems = []
+    by_index = {}
+    for manifest in manifests:
+        index = manifest["shard"]
+        if manifest["shards"] != count or \
+           manifest["selections"] != total or \
+           manifest["inputs"] != first["inputs"]:
+            problems.append("Shard %d/%d is not from the same run as "
+                            "shard %d/%d" % (index, manifest["shards"],
+                                             first["shard"], count))
+            continue
+        if index in by_index:
+            problems.append("Shard %d/%d is given more than once" %
+                            (index, count))
+            continue
+        if manifest["range"] != list(shard_range(index, count, total)):
+            problems.append("Shard %d/%d generated selections %d to %d "
+                            "instead of %d to %d" %
+                            ((index, count) + tuple(manifest["range"]) +
+                             shard_range(index, count, total)))
+            continue
+        by_index[index] = manifest
+    given = set([manifest["shard"] for manifest in manifests])
+    for index in range(0, count):
+        if not index in given:
+            problems.append("Shard %d/%d is missing" % (index, count))
+    if problems:
+        raise ShardError("\n".join(problems))
+
+    files = {}
+    for index in sorted(by_index.keys()):
+        for filename, digest in by_index[index]["files"].iteritems():
+            files[filename] = (digest, index)
+    return files
+
+def load_manifest(path):
+    with open(path) as f:
+        return json.load(f)
+
+def main(args):
+    try:
+        manifests = [load_manifest(path) for path in args.manifests]
+        files = merge_shards(manifests)
+    except (IOError, ValueError, KeyError), err:
+        print 'Manifest Error:', err
+        sys.exit(1)
+    except ShardError, err:
+        print 'Shard Error:', err.message
+        sys.exit(1)
+
+    written = {}
+    for manifest in manifests:
+        for filename in manifest["files"]:
+            written[filename] = written.get(filename, 0) + 1
+    shared = len([f for f, times in written.iteritems() if times > 1])
+    print "Merged %d shards: %d files, %d written by more than one shard" % \
+          (len(manifests), len(files), shared)
+    if args.output:
+        # Same format as the manifest of --manifest.
+        with open(args.output, "w") as f:
+            json.dump({"files": dict([(filename, digest) for filename,
+                                      (digest, index) in files.iteritems()])},
+                      f, indent=0, sort_keys=True)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Checks that shard manifests cover a whole run')
+    parser.add_argument('manifests', nargs='+',
+        help='Shard manifests written with --shard')
+    parser.add_argument('-o', '--output', default=None,
+        help='Writes the merged manifest of all files to the file')
+    args = parser.parse_args()
+    main(args)
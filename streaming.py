@@ -0,0 +1,179 @@
+import io
+import json
+import re
+
+class StreamError(ValueError):
+    """Error raised when a streamed spec is not valid JSON."""
+    pass
+
+class _Scanner(object):
+    """Reads JSON values one at a time from a file, keeping only the
+       unparsed remainder of what was read in memory."""
+
+    _whitespace = u" \t\n\r"
+    _number_characters = u"0123456789.eE+-"
+    _re_error_location = re.compile(r": line \d+ column \d+ \(char (\d+)\)")
+
+    def __init__(self, filename, chunk_size):
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self._file = io.open(filename, encoding="utf-8")
+        self._decoder = json.JSONDecoder()
+        self._buffer = u""
+        self._position = 0
+        self._line = 1
+        self._line_start = 0
+        self._offset = 0
+        self._eof = False
+
+    def close(self):
+        self._file.close()
+
+    def _fill(self, size=None):
+        if self._eof:
+            return False
+        chunk = self._file.read(size or self.chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        # Drop what was parsed, remembering where the buffer starts.
+        consumed = self._buffer[:self._position]
+        newlines = consumed.count(u"\n")
+        if newlines:
+            self._line += newlines
+            self._line_start = self._offset + consumed.rindex(u"\n") + 1
+        self._offset += self._position
+        self._buffer = self._buffer[self._position:] + chunk
+        self._position = 0
+        return True
+
+    def peek(self):
+        """Returns the next non-whitespace character, None at the end."""
+        while True:
+            buffer = self._buffer
+            position = self._position
+            while position < len(buffer) and buffer[position] in \
+                  self._whitespace:
+                position += 1
+            self._position = position
+            if position < len(buffer):
+                return buffer[position]
+            if not self._fill():
+                return None
+
+    def expect(self, characters):
+        character = self.peek()
+        if character is None or not character in characters:
+            self.fail("Expecting one of %s" % ", ".join(
+                ["'%s'" % c for c in characters]))
+        self._position += 1
+        return character
+
+    def value(self):
+        """Decodes the next value. The buffer grows until the value is
+           complete, so it is never larger than the largest value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer,
+                                                      self._position)
+                # A number may continue past what has been read so far.
+                if not isinstance(value, (int, long, float)) or \
+                   isinstance(value, bool) or self._eof or \
+                   (end < len(self._buffer) and
+                    not self._buffer[end] in self._number_characters):
+                    self._position = end
+                    return value
+            except ValueError, err:
+                error = err
+            else:
+                error = None
+            if not self._fill(max(self.chunk_size, len(self._buffer))):
+                if error is not None:
+                    # Point at where the decoder failed rather than at the
+                    # start of the value.
+                    match = self._re_error_location.search(error.message)
+                    if match is None:
+                        self.fail(error.message)
+                    self.fail(error.message[:match.start()],
+                              int(match.group(1)))
+
+    def fail(self, message, position=None):
+        if position is None:
+            position = self._position
+        absolute = self._offset + position
+        preceding = self._buffer[:position]
+        line = self._line + preceding.count(u"\n")
+        if u"\n" in preceding:
+            line_start = self._offset + preceding.rindex(u"\n") + 1
+        else:
+            line_start = self._line_start
+        raise StreamError("In: %s\nLine %d column %d: %s" % \
+                          (self.filename, line, absolute - line_start + 1,
+                           message))
+
+class StreamedArray(object):
+    """The entries of a top-level array, parsed as they are iterated."""
+
+    def __init__(self, entries):
+        self._entries = entries
+
+    def __iter__(self):
+        return self._entries
+
+class StreamedSpec(object):
+    """A spec file whose top-level arrays are read entry by entry.
+
+       The file must hold a JSON object. Its arrays are not kept in memory,
+       entries() parses the file again each time it is called."""
+
+    def __init__(self, filename, chunk_size=65536):
+        self.filename = filename
+        self.chunk_size = chunk_size
+
+    def items(self, streamed=None):
+        """Yields (key, value) for the top-level members in file order. The
+           value of an array whose key streamed accepts is a StreamedArray,
+           which has to be iterated before the next member."""
+        scanner = _Scanner(self.filename, self.chunk_size)
+        try:
+            scanner.expect(u"{")
+            if scanner.peek() == u"}":
+                return
+            while True:
+                key = scanner.value()
+                if not isinstance(key, basestring):
+                    scanner.fail("Expecting property name")
+                scanner.expect(u":")
+                if scanner.peek() == u"[" and \
+                   (streamed is None or streamed(key)):
+                    entries = self._entries(scanner)
+                    yield key, StreamedArray(entries)
+                    for entry in entries:
+                        pass
+                else:
+                    yield key, scanner.value()
+                if scanner.expect(u",}") == u"}":
+                    break
+            if scanner.peek() is not None:
+                scanner.fail("Extra data")
+        finally:
+            scanner.close()
+
+    def _entries(self, scanner):
+        scanner.expect(u"[")
+        if scanner.peek() == u"]":
+            scanner.expect(u"]")
+            return
+        while True:
+            yield scanner.value()
+            if scanner.expect(u",]") == u"]":
+                return
+
+    def entries(self, key):
+        """Yields the entries of a top-level array."""
+        for member, value in self.items():
+            if member == key:
+                for entry in value:
+                    yield entry
+                return
@@ -0,0 +1,180 @@
+from operator import itemgetter
+import re
+
+class Template(object):
+    """A %-style template parsed once into literal segments and slots.
+
+       Rendering fills the slots in place of re-running the % operator on the
+       raw text. Templates without placeholders are constants and render to
+       the same string regardless of the values."""
+
+    _re_specifier = re.compile(r'%(?:\(([^)]*)\))?([#0\- +]*)(\*|[0-9]+)?'
+                               r'(?:\.(\*|[0-9]+))?[hlL]?([diouxXeEfFgGcrs%])')
+
+    def __init__(self, source):
+        self.source = source
+        self.literals = []
+        self.slots = []
+        self._fallback = False
+        self._keys = []
+        self._parse(source)
+        self.keys = frozenset(self._keys)
+        self.is_constant = not self._fallback and len(self.slots) == 0
+        if self.is_constant:
+            self._constant = self.literals[0]
+        # Whether every slot formats its value with %s, so equal string
+        # values render the same.
+        self.formats_strings = not self._fallback and \
+            all([specifier.endswith("s") for key, specifier in self.slots])
+
+    def _parse(self, source):
+        literal = []
+        position = 0
+        while True:
+            index = source.find('%', position)
+            if index < 0:
+                literal.append(source[position:])
+                break
+            literal.append(source[position:index])
+            match = self._re_specifier.match(source, index)
+            if match is None:
+                self._raise_invalid(source, index)
+
+            key, flags, width, precision, conversion = match.groups()
+            position = match.end()
+            if key is not None:
+                self._keys.append(key)
+            if conversion == '%' and key is None and not (flags or width):
+                literal.append('%')
+                continue
+
+            if key is None or conversion == '%' or \
+               width == '*' or precision == '*':
+                # Anything that is not a plain keyed slot is left to the %
+                # operator, which formats it against the mapping as a whole.
+                self._fallback = True
+                continue
+
+            specifier = "%" + flags + (width or "")
+            if precision is not None:
+                specifier += "." + precision
+            self.literals.append(''.join(literal))
+            self.slots.append((key, specifier + conversion))
+            literal = []
+        self.literals.append(''.join(literal))
+
+    def _raise_invalid(self, source, index):
+        if source.startswith('%(', index) and source.find(')', index) < 0:
+            raise ValueError("incomplete format key")
+        end = index + 1
+        while end < len(source) and source[end] in "#0- +.*0123456789hlL" or \
+              source.startswith('(', end):
+            if source[end] == '(':
+                end = source.find(')', end)
+            end += 1
+        if end >= len(source):
+            raise ValueError("incomplete format")
+        raise ValueError(
+            "unsupported format character '%s' (0x%x) at index %d" % \
+            (source[end], ord(source[end]), end))
+
+    def render(self, values):
+        if self.is_constant:
+            return self._constant
+        if self._fallback:
+            return self.source % values
+
+        parts = [self.literals[0]]
+        i = 1
+        for key, specifier in self.slots:
+            value = values[key]
+            if specifier == "%s" and isinstance(value, basestring):
+                parts.append(value)
+            else:
+                parts.append(specifier % (value,))
+            parts.append(self.literals[i])
+            i += 1
+        return ''.join(parts)
+
+    def __repr__(self):
+        return "Template(%r)" % self.source
+
+def holds_strings(key, count):
+    """Tells whether a key taken with itemgetter() over count keys holds
+       strings only. Equal strings render the same under %s, which does not
+       hold for other values (1, 1.0 and True)."""
+    if count == 1:
+        return isinstance(key, basestring)
+    for value in key:
+        if not isinstance(value, basestring):
+            return False
+    return True
+
+class RenderCache(object):
+    """Renders templates, reusing an output for the same values of the keys
+       the template references. Keeps at most limit outputs, templates using
+       __index__ or anything but %s, or missing most of their first
+       probe_misses renders, are rendered every time."""
+
+    probe_misses = 256
+
+    def __init__(self, limit=1024):
+        self.limit = limit
+        self.hits = 0
+        self.misses = 0
+        self._recent = {}
+        self._older = {}
+        # Template to [key getter or None, hits, misses].
+        self._templates = {}
+
+    def _entry(self, template):
+        try:
+            return self._templates[template]
+        except KeyError:
+            getter = None
+            if template.formats_strings and template.keys and \
+               not "__index__" in template.keys:
+                getter = itemgetter(*sorted(template.keys))
+            entry = [getter, 0, 0]
+            self._templates[template] = entry
+            return entry
+
+    def _keep(self, key, output):
+        if len(self._recent) >= max(1, self.limit // 2):
+            self._older = self._recent
+            self._recent = {}
+        self._recent[key] = output
+
+    def render(self, template, values):
+        entry = self._entry(template)
+        if entry[0] is None:
+            return template.render(values)
+        key = (template, entry[0](values))
+        try:
+            output = self._recent.get(key)
+            if output is None:
+                output = self._older.get(key)
+                if output is not None:
+                    self._keep(key, output)
+        except TypeError:
+            return template.render(values)
+        if output is not None:
+            self.hits += 1
+            entry[1] += 1
+            return output
+
+        self.misses += 1
+        entry[2] += 1
+        if entry[2] == self.probe_misses and entry[1] < entry[2]:
+            entry[0] = None
+        output = template.render(values)
+        if holds_strings(key[1], len(template.keys)):
+            self._keep(key, output)
+        return output
+
+    def caches(self, template):
+        """Tells whether outputs of the template are (still) kept."""
+        return self._entry(template)[0] is not None
+
+    def __len__(self):
+        return len(self._recent) + len(self._older)
@@ -0,0 +1,30 @@
+import test_includes
+import unittest
+from bench.bench_scaling import MemoryWriter
+from bench.synthetic import synthetic_case
+from generator import Generator
+
+class SyntheticCaseTestCase(unittest.TestCase):
+    def generate(self, **shape):
+        spec, schema = synthetic_case(**shape)
+        writer = MemoryWriter()
+        Generator(spec, schema, writer=writer).generate()
+        return writer
+
+    def test_shape_determinesSelections(self):
+        writer = self.generate(depth=2, leaves=3, keys=2, values=4,
+                               suppression=0.5, template_size=100)
+        self.assertEquals(3 * 4 * 4 / 2, writer.outputs)
+        self.assertEquals(writer.outputs, len(writer.files))
+        for filename, content in writer.files.iteritems():
+            self.assertTrue(filename.startswith("group0/group1/"))
+            # The template is 100 bytes, the values are longer than the keys.
+            self.assertTrue(100 <= len(content) < 120)
+
+    def test_noSuppression_generatesEverySelection(self):
+        writer = self.generate(depth=0, leaves=1, keys=3, values=2,
+                               suppression=0)
+        self.assertEquals(8, writer.outputs)
+
+if __name__ == '__main__':
+    unittest.main()
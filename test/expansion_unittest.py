@@ -0,0 +1,65 @@
+import test_includes
+import unittest
+from expansion import Expansion
+from selection import SuppressionMatcher
+
+class ExpansionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.pattern = {"fruit": ["apple", "pear"],
+                        "color": ["red", "green", "yellow"],
+                        "size": ["big"]}
+
+    def test_iteration_varyLastKeyFastest(self):
+        expansion = Expansion(self.pattern)
+        keys = self.pattern.keys()
+        expected = []
+        for first in self.pattern[keys[0]]:
+            for second in self.pattern[keys[1]]:
+                for third in self.pattern[keys[2]]:
+                    expected.append({keys[0]: first,
+                                     keys[1]: second,
+                                     keys[2]: third})
+        self.assertEquals(expected, list(expansion))
+        self.assertEquals(6, len(expansion))
+
+    def test_selections_areNotShared(self):
+        selections = list(Expansion(self.pattern))
+        selections[0]["fruit"] = "lemon"
+        self.assertEquals(6, len(set([id(s) for s in selections])))
+        self.assertNotEquals("lemon", selections[1]["fruit"])
+
+    def test_indicesAt_matchesIterationOrder(self):
+        expansion = Expansion(self.pattern)
+        indices = list(expansion.indices())
+        for offset in range(0, len(expansion)):
+            self.assertEquals(indices[offset], expansion.indices_at(offset))
+        self.assertEquals(list(expansion),
+                          [expansion.selection(i) for i in indices])
+        self.assertRaises(IndexError, expansion.indices_at, 6)
+
+    def test_indicesRange_matchesSliceOfIndices(self):
+        expansion = Expansion(self.pattern)
+        indices = list(expansion.indices())
+        for start in range(0, 7):
+            for stop in range(start, 8):
+                self.assertEquals(indices[start:stop],
+                                  list(expansion.indices(start, stop)))
+            self.assertEquals(indices[start:],
+                              list(expansion.indices(start)))
+
+    def test_emptyValueList_expandsToNothing(self):
+        self.pattern["size"] = []
+        self.assertEquals([], list(Expansion(self.pattern)))
+        self.assertEquals(0, len(Expansion(self.pattern)))
+
+    def test_indexedIdentity_matchesSelectionIdentity(self):
+        matcher = SuppressionMatcher()
+        expansion = Expansion(self.pattern)
+        identity = matcher.identity(self.pattern)
+        identify = identity.indexed(expansion)
+        for indices in expansion.indices():
+            self.assertEquals(identity.key(expansion.selection(indices)),
+                              identify(indices))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,13 +1,20 @@
 import test_includes
 import unittest
 import generator
+import copy
+import errno
+import os
+import shutil
+import tempfile
 
 class MockWriter(object):
     def __init__(self):
         self.fs = {}
+        self.log = []
 
     def write(self, filename, content):
         self.fs[filename] = content
+        self.log.append(filename)
 
 class GeneratorTestCase(unittest.TestCase):
     def test_simple_generatesSelection(self):
@@ -202,6 +209,176 @@ class GeneratorTestCase(unittest.TestCase):
 
         self.assert_generated(expected, generated=g.writer.fs)
 
+    def test_undefinedTemplateKey_failsBeforeWriting(self):
+        spec = {"scenarios": [{"fruit": "apple"}, {"fruit": "pear"}]}
+        schema = {
+          "/scenarios/*": {
+            "matches": {"fruit": "non_empty_string"},
+            "action": "generate",
+            "path": "%(fruit)s.html",
+            "template": "%(fruit)s",
+            "when": [{
+              "match_any": [["%(fruit)s", "pear"]],
+              "do": [{
+                "action": "generate",
+                "path": "%(fruit)s.html.headers",
+                "template": "Color: %(color)s"
+              }]
+            }]
+          }
+        }
+
+        g = generator.Generator(spec, schema, writer=MockWriter())
+        self.assertRaises(generator.SchemaError, g.generate)
+        self.assertEquals({}, g.writer.fs)
+
+    def test_whenRules_seeExtensionsOfEarlierRules(self):
+        spec = {"scenarios": [{"fruit": "*", "size": "*"}]}
+        schema = {
+          "/scenarios/*": {
+            "matches": {"fruit": ["pear", "lemon"],
+                        "size": ["small", "big"]},
+            "action": "generate",
+            "path": "%(fruit)s-%(size)s.html",
+            "template": "%(taste)s",
+            "extensions": {"taste": "plain"},
+            "when": [{
+              "match_any": [["%(fruit)s", "lemon"], ["never", "ever"]],
+              "do": [{
+                "action": "update_extensions",
+                "extensions": {"taste": "sour"}
+              }]
+            }, {
+              "match_any": [["%(taste)s-%(size)s", "sour-big"]],
+              "do": [{
+                "action": "generate",
+                "path": "%(fruit)s-%(size)s.html.headers",
+                "template": "Taste: %(taste)s"
+              }]
+            }, {
+              "match_any": [["constant", "other constant"]],
+              "do": [{
+                "action": "generate",
+                "path": "never.html",
+                "template": "never"
+              }]
+            }]
+          }
+        }
+
+        g = generator.Generator(spec, schema, writer=MockWriter())
+        g.generate()
+
+        self.assertEquals({"pear-small.html": "plain",
+                           "pear-big.html": "plain",
+                           "lemon-small.html": "sour",
+                           "lemon-big.html": "sour",
+                           "lemon-big.html.headers": "Taste: sour"},
+                          g.writer.fs)
+
+    def test_parallelRendering_matchesSerialRun(self):
+        spec = {"scenarios": [{"fruit": "*", "color": "*", "size": "*"},
+                              {"fruit": "pear", "color": "*", "size": "big"}],
+                "skip": [{"fruit": "apple", "color": "red", "size": "*"}]}
+        schema = {
+          "/scenarios/*": {
+            "matches": "@scenario_schema",
+            "action": "generate",
+            "path": "%(fruit)s/%(color)s.html",
+            "template": "%(__index__)s: %(size)s %(color)s %(fruit)s",
+            "when": [{
+              "match_any": [["%(size)s", "big"]],
+              "do": [{
+                "action": "generate",
+                "path": "%(fruit)s/%(__index__)s.html.headers",
+                "template": "Size: %(size)s"
+              }]
+            }]
+          },
+          "/skip/*": {
+            "matches": "@scenario_schema",
+            "action": "suppress"
+          },
+          "#scenario_schema": {
+            "fruit": ["apple", "pear", "lemon"],
+            "color": ["red", "green", "yellow"],
+            "size": ["small", "big"]
+          }
+        }
+
+        serial = generator.Generator(spec, schema, writer=MockWriter())
+        serial.generate()
+        parallel = generator.Generator(spec, schema, writer=MockWriter(),
+                                       jobs=3, batch_size=2)
+        parallel.generate()
+
+        self.assertEquals(serial.writer.log, parallel.writer.log)
+        self.assertEquals(serial.writer.fs, parallel.writer.fs)
+        # The second scenario has the last word on colliding paths.
+        index, content = parallel.writer.fs["pear/yellow.html"].split(": ")
+        self.assertEquals("big yellow pear", content)
+        self.assertTrue(int(index) >= 18)
+
+    def test_plan_countsSelectionsWithoutGenerating(self):
+        spec = {"scenarios": [{"fruit": "*", "color": "*", "size": "*"},
+                              {"fruit": "pear", "color": "*", "size": "big"}],
+                "skip": [{"fruit": "apple", "color": "red", "size": "*"}]}
+        schema = {
+          "/scenarios/*": {
+            "matches": "@scenario_schema",
+            "action": "generate",
+            "path": "%(fruit)s/%(color)s/%(size)s.html",
+            "template": "%(fruit)s"
+          },
+          "/skip/*": {
+            "matches": "@scenario_schema",
+            "action": "suppress"
+          },
+          "#scenario_schema": {
+            "fruit": ["apple", "pear", "lemon"],
+            "color": ["red", "green", "yellow"],
+            "size": ["small", "big"]
+          }
+        }
+
+        g = generator.Generator(copy.deepcopy(spec), schema,
+                                writer=MockWriter())
+        plan = g.plan()
+        self.assertEquals({}, g.writer.fs)
+        self.assertEquals(1, len(plan.leafs))
+        leaf = plan.leafs[0]
+        self.assertEquals("/scenarios/*", leaf.path)
+        self.assertEquals(2, leaf.nodes)
+        self.assertEquals(21, leaf.combinations)
+        self.assertEquals(2, leaf.suppressed)
+        self.assertEquals(19, leaf.selections)
+        self.assertEquals(19, leaf.outputs)
+
+        g.generate()
+        self.assertEquals(19, len(g.writer.log))
+        self.assertEquals(16, len(g.writer.fs))
+
+        self.assertRaises(generator.BudgetError, plan.check_budget,
+                          max_outputs=18)
+        plan.check_budget(max_outputs=19, max_bytes=100)
+
+    def test_nullValueInMetaSchema_isAccepted(self):
+        spec = {"scenarios": [{"policy": "*"}]}
+        schema = {
+          "/scenarios/*": {
+            "matches": {"policy": "@policy_schema"},
+            "action": "generate",
+            "path": "%(__index__)s.html",
+            "template": "%(policy)s"
+          },
+          "#policy_schema": [None, "no-referrer"]
+        }
+
+        g = generator.Generator(spec, schema, writer=MockWriter())
+        g.generate()
+        self.assertEquals({"0.html": "None", "1.html": "no-referrer"},
+                          g.writer.fs)
+
     def assert_generated(self, expected, generated):
         self.assertEquals(len(expected), len(generated))
         expected = sorted(expected)
@@ -210,6 +387,120 @@ class GeneratorTestCase(unittest.TestCase):
             self.assertEquals(expected[i], (file_path, generated_value))
             i+=1
 
+class IncrementalGenerationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+        with open("test.template", "w") as f:
+            f.write("%(_title)s: %(color)s %(fruit)s")
+        self.spec = {"groups": [
+            {"name": "sweet", "title": "Sweet",
+             "scenarios": [{"fruit": "pear", "color": "*"}]},
+            {"name": "sour", "title": "Sour",
+             "scenarios": [{"fruit": "lemon", "color": "*"}]}]}
+        self.schema = {
+          "/groups/*": {
+            "matches": {"name": "non_empty_string",
+                        "title": "non_empty_string",
+                        "scenarios": "non_empty_list"},
+            "/scenarios/*": {
+              "matches": {"fruit": "non_empty_string",
+                          "color": ["red", "green"]},
+              "action": "generate",
+              "path": "%(_name)s/%(color)s-%(fruit)s.html",
+              "template": {"__main__": "test.template"}
+            }
+          }
+        }
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def generate(self):
+        writer = MockWriter()
+        writer.write = lambda filename, content: \
+            (MockWriter.write(writer, filename, content),
+             generator.OutputWriter().write(filename, content))
+        dependencies = generator.DependencyCache("deps.json")
+        g = generator.Generator(copy.deepcopy(self.spec), self.schema,
+                                writer=writer, dependencies=dependencies)
+        g.generate()
+        dependencies.save()
+        return writer, dependencies
+
+    def test_unchangedInputs_areNotRegenerated(self):
+        writer, dependencies = self.generate()
+        self.assertEquals(4, len(writer.log))
+        writer, dependencies = self.generate()
+        self.assertEquals([], writer.log)
+        self.assertEquals(2, dependencies.reused)
+
+    def test_changedSpecEntry_regeneratesItsOutputsOnly(self):
+        self.generate()
+        self.spec["groups"][1]["title"] = "Very sour"
+        writer, dependencies = self.generate()
+        self.assertEquals(["sour/green-lemon.html", "sour/red-lemon.html"],
+                          sorted(writer.log))
+        with open("sour/red-lemon.html") as f:
+            self.assertEquals("Very sour: red lemon", f.read())
+
+    def test_collidingPath_keepsLastWriter(self):
+        self.schema["/groups/*"]["/scenarios/*"]["path"] = "%(color)s.html"
+        self.generate()
+        self.spec["groups"][0]["title"] = "Very sweet"
+        writer, dependencies = self.generate()
+        with open("red.html") as f:
+            self.assertEquals("Sour: red lemon", f.read())
+
+    def test_changedTemplate_regeneratesItsOutputs(self):
+        self.generate()
+        with open("test.template", "w") as f:
+            f.write("%(color)s %(fruit)s")
+        writer, dependencies = self.generate()
+        self.assertEquals(4, len(writer.log))
+        with open("sweet/red-pear.html") as f:
+            self.assertEquals("red pear", f.read())
+
+class FileReaderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.template_path = os.path.join(self.directory, "a.template")
+        with open(self.template_path, "w") as f:
+            f.write("%(a)s")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_repeatedRead_hitsCache(self):
+        reader = generator.FileReader()
+        for i in range(0, 3):
+            self.assertEquals("%(a)s",
+                              reader.read("a.template", [self.directory]))
+        self.assertEquals(1, reader.misses)
+        self.assertEquals(2, reader.hits)
+
+    def test_modifiedFile_invalidatesCache(self):
+        reader = generator.FileReader()
+        reader.read("a.template", [self.directory])
+        with open(self.template_path, "w") as f:
+            f.write("%(a)s %(b)s")
+        self.assertEquals("%(a)s %(b)s",
+                          reader.read("a.template", [self.directory]))
+        self.assertEquals(2, reader.misses)
+        self.assertEquals(0, reader.hits)
+
+    def test_missingFile_raises(self):
+        reader = generator.FileReader()
+        self.assertRaises(IOError, reader.read, "b.template", [self.directory])
+        try:
+            reader.read("b.template", [self.directory])
+            self.fail()
+        except generator.ReadError, err:
+            self.assertEquals(errno.ENOENT, err.errno)
+            self.assertEquals("b.template", err.filename)
+
 
 if __name__ == '__main__':
     unittest.main()
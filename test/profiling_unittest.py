@@ -0,0 +1,66 @@
+import test_includes
+import unittest
+import generator
+from profiling import Profiler
+
+class MockWriter(object):
+    def __init__(self):
+        self.fs = {}
+
+    def write(self, filename, content):
+        self.fs[filename] = content
+
+class ProfilerTestCase(unittest.TestCase):
+    def createGenerator(self):
+        spec = {"groups": [{"name": "fruits",
+                            "scenarios": [{"fruit": "*", "color": "*"}]}],
+                "skip": [{"fruit": "apple", "color": "red"}]}
+        schema = {
+          "/groups/*": {
+            "matches": {"name": "non_empty_string",
+                        "scenarios": "non_empty_list"},
+            "/scenarios/*": {
+              "matches": "@scenario_schema",
+              "action": "generate",
+              "path": "%(fruit)s/%(color)s.html",
+              "template": "%(color)s %(fruit)s"
+            }
+          },
+          "/skip/*": {
+            "matches": "@scenario_schema",
+            "action": "suppress"
+          },
+          "#scenario_schema": {
+            "fruit": ["apple", "pear"],
+            "color": ["red", "green"]
+          }
+        }
+        return generator.Generator(spec, schema, writer=MockWriter())
+
+    def test_phases_areCountedPerLeaf(self):
+        g = self.createGenerator()
+        profiler = Profiler()
+        profiler.instrument(g)
+        g.generate()
+        profiler.finish()
+
+        self.assertEquals(3, len(g.writer.fs))
+        calls = dict([(phase, stats.calls)
+                      for phase, stats in profiler.phases.iteritems()])
+        self.assertEquals({"validate": 1, "traverse": 1, "expand": 1,
+                           "render": 3, "write": 3}, calls)
+        leaf = profiler.leafs["/groups/*/scenarios/*"]
+        self.assertEquals(["expand", "render", "write"], sorted(leaf.keys()))
+        report = profiler.report()
+        self.assertEquals(3, report["phases"]["render"]["calls"])
+        self.assertTrue(report["phases"]["render"]["wall"] >= 0)
+        self.assertTrue("render (s)" in profiler.format())
+
+    def test_withoutProfiler_methodsAreNotWrapped(self):
+        g = self.createGenerator()
+        g.generate()
+        self.assertFalse("_render" in g.__dict__)
+        self.assertFalse("write" in g.writer.__dict__)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import test_includes
+import unittest
+import generator
+import json
+import StringIO
+from progress import Reporter, QUIET, SUMMARY, TRACE
+
+class NullWriter(object):
+    def write(self, filename, content):
+        pass
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+class ReporterTestCase(unittest.TestCase):
+    def generate(self, reporter):
+        spec = {"scenarios": [{"fruit": "*", "color": "*"}],
+                "skip": [{"fruit": "apple", "color": "red"}]}
+        schema = {
+          "/scenarios/*": {
+            "matches": "@scenario_schema",
+            "action": "generate",
+            "path": "%(fruit)s/%(color)s.html",
+            "template": "%(color)s %(fruit)s"
+          },
+          "/skip/*": {
+            "matches": "@scenario_schema",
+            "action": "suppress"
+          },
+          "#scenario_schema": {
+            "fruit": ["apple", "pear"],
+            "color": ["red", "green"]
+          }
+        }
+        g = generator.Generator(spec, schema, writer=NullWriter(),
+                                reporter=reporter)
+        g.generate()
+
+    def test_quiet_printsNothing(self):
+        stream = StringIO.StringIO()
+        self.generate(Reporter(level=QUIET, stream=stream))
+        self.assertEquals("", stream.getvalue())
+
+    def test_summary_printsOneLine(self):
+        stream = StringIO.StringIO()
+        reporter = Reporter(level=SUMMARY, stream=stream)
+        self.generate(reporter)
+        lines = stream.getvalue().splitlines()
+        self.assertEquals(1, len(lines))
+        self.assertTrue(lines[0].startswith(
+            "Generated 3 selections (1 excluded) into 3 outputs"))
+        self.assertEquals((3, 1, 3), (reporter.generated, reporter.excluded,
+                                      reporter.outputs))
+
+    def test_trace_printsEverySelection(self):
+        stream = StringIO.StringIO()
+        self.generate(Reporter(level=TRACE, stream=stream))
+        lines = stream.getvalue().splitlines()
+        self.assertEquals(1, len([l for l in lines
+                                  if l.startswith("To be excluded")]))
+        self.assertEquals(1, len([l for l in lines
+                                  if l.startswith("Excluding")]))
+        self.assertEquals(3, len([l for l in lines
+                                  if l.startswith("Generating {")]))
+        self.assertEquals(1, len([l for l in lines
+                                  if l.startswith("Generated 3 of 4")]))
+
+    def test_events_areJsonLines(self):
+        events = StringIO.StringIO()
+        self.generate(Reporter(level=QUIET, stream=StringIO.StringIO(),
+                               events=events))
+        events = [json.loads(line) for line in events.getvalue().splitlines()]
+        self.assertEquals(["start", "node", "finish"],
+                          [e["event"] for e in events])
+        self.assertEquals(4, events[0]["combinations"])
+        self.assertEquals(3, events[-1]["outputs"])
+
+    def test_progress_isThrottled(self):
+        clock = FakeClock()
+        progress = StringIO.StringIO()
+        reporter = Reporter(stream=StringIO.StringIO(),
+                            progress_stream=progress, interval=1.0,
+                            clock=clock)
+        reporter.start(1, 100)
+        clock.now += 0.5
+        reporter.progress(10, 10)
+        self.assertEquals("", progress.getvalue())
+        clock.now += 1.5
+        reporter.progress(50, 40)
+        self.assertEquals("\r50/100 combinations, 40 selections, "
+                          "20 selections/s, ETA 2s", progress.getvalue())
+        reporter.node("/a", "/a/0", 100, 80)
+        reporter.finish(80)
+        self.assertTrue(progress.getvalue().endswith("\r"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,225 @@
+import test_includes
+import unittest
+from selection import SuppressionMatcher, SelectionIdentity, ValueInterner, \
+                      NodeLayers, WhenCondition
+from template import Template
+
+class SuppressionMatcherTestCase(unittest.TestCase):
+    def createMatcher(self):
+        matcher = SuppressionMatcher()
+        matcher.add({"name": "skip lemons",
+                     "fruit": ["lemon"],
+                     "color": ["green", "red"]})
+        matcher.add({"fruit": ["orange"], "color": ["green"]})
+        return matcher
+
+    def test_matchingSelection_isSuppressed(self):
+        matcher = self.createMatcher()
+        self.assertTrue(matcher.matches({"fruit": "lemon", "color": "red"}))
+        self.assertTrue(matcher.matches({"name": "other",
+                                         "fruit": "orange",
+                                         "color": "green"}))
+
+    def test_nonMatchingSelection_isNotSuppressed(self):
+        matcher = self.createMatcher()
+        self.assertFalse(matcher.matches({"fruit": "lemon",
+                                          "color": "yellow"}))
+        self.assertFalse(matcher.matches({"fruit": "lemon", "color": "red",
+                                          "expectation": "sour"}))
+
+    def test_restrict_dropsIrrelevantPatternsAndSatisfiedKeys(self):
+        matcher = self.createMatcher()
+        self.assertEquals([], matcher.restrict({"fruit": ["pear"],
+                                                "color": ["red"]}))
+        self.assertEquals([[]], matcher.restrict({"fruit": ["lemon"],
+                                                  "color": ["red"]}))
+        pattern = {"fruit": ["lemon"], "color": ["red", "yellow"]}
+        rules = matcher.restrict(pattern)
+        self.assertEquals(1, len(rules))
+        identity = matcher.identity(pattern)
+        self.assertEquals(("color", "fruit"), identity.keys)
+        self.assertEquals([0], [position for position, allowed in rules[0]])
+        self.assertTrue(matcher.matches_key(
+            identity.key({"fruit": "lemon", "color": "red"}), rules))
+        self.assertFalse(matcher.matches_key(
+            identity.key({"fruit": "lemon", "color": "yellow"}), rules))
+
+    def test_memory_isProportionalToPatterns(self):
+        matcher = SuppressionMatcher()
+        values = [str(i) for i in range(0, 100)]
+        matcher.add({"a": values, "b": values, "c": values, "d": values})
+        self.assertEquals(1, len(matcher))
+        self.assertTrue(matcher.matches({"a": "1", "b": "2",
+                                         "c": "3", "d": "99"}))
+
+    def test_duplicatePattern_isStoredOnce(self):
+        matcher = self.createMatcher()
+        matcher.add({"fruit": ["orange"], "color": ["green"]})
+        self.assertEquals(2, len(matcher))
+
+    def test_count_handlesOverlappingPatterns(self):
+        matcher = self.createMatcher()
+        matcher.add({"fruit": ["lemon", "orange"], "color": ["green"]})
+        pattern = {"fruit": ["lemon", "orange", "pear"],
+                   "color": ["green", "red", "yellow"]}
+        expected = len([1 for fruit in pattern["fruit"]
+                        for color in pattern["color"]
+                        if matcher.matches({"fruit": fruit, "color": color})])
+        self.assertEquals(3, expected)
+        self.assertEquals(expected, matcher.count(pattern))
+        self.assertEquals(0, matcher.count({"fruit": ["pear"],
+                                            "color": ["green"]}))
+
+    def test_count_manyOverlappingPatterns(self):
+        values = ["a", "b", "c"]
+        keys = ["k%d" % i for i in range(0, 6)]
+        pattern = dict([(key, values) for key in keys])
+        # Patterns of "*" but for one or two keys, and patterns restricting
+        # every key, which overlap too much to be counted by classes.
+        for restricted in [[values[:1], values[1:]], [values[:2], values[1:]]]:
+            matcher = SuppressionMatcher()
+            for i in range(0, 40):
+                matcher.add(dict([(key, restricted[(i >> j) & 1]
+                                        if j % 3 == i % 3 or
+                                           restricted[0] == values[:2]
+                                        else values)
+                                  for j, key in enumerate(keys)]))
+            expected = 0
+            for i in range(0, 3 ** len(keys)):
+                selection = dict([(key, values[(i // 3 ** j) % 3])
+                                  for j, key in enumerate(keys)])
+                if matcher.matches(selection):
+                    expected += 1
+            self.assertEquals(expected, matcher.count(pattern))
+
+class SelectionIdentityTestCase(unittest.TestCase):
+    def test_key_ignoresOrderingAndComments(self):
+        interner = ValueInterner()
+        identity = SelectionIdentity(interner, {"name": ["x"],
+                                                "color": ["red"],
+                                                "fruit": ["apple", "pear"]})
+        first = identity.key({"fruit": "apple", "color": "red", "name": "x"})
+        second = identity.key({"name": "y", "color": "red", "fruit": "apple"})
+        self.assertEquals(first, second)
+        self.assertNotEquals(first, identity.key({"fruit": "pear",
+                                                  "color": "red"}))
+        self.assertEquals(3, len(interner))
+
+    def test_equalValuesOfDifferentTypes_areToldApart(self):
+        interner = ValueInterner()
+        identity = SelectionIdentity(interner, {"count": [1]})
+        keys = [identity.key({"count": value})
+                for value in [1, True, 1.0, "1", [1], [True]]]
+        self.assertEquals(len(keys), len(set(keys)))
+        self.assertEquals(keys[0], identity.key({"count": 1}))
+        self.assertEquals(keys[4], identity.key({"count": [1]}))
+
+        matcher = SuppressionMatcher(interner)
+        matcher.add({"count": [1]})
+        self.assertTrue(matcher.matches({"count": 1}))
+        self.assertFalse(matcher.matches({"count": True}))
+        self.assertFalse(matcher.matches({"count": 1.0}))
+
+    def test_unhashableValues_areInterned(self):
+        interner = ValueInterner()
+        self.assertEquals(interner.intern([1, 2]), interner.intern([1, 2]))
+        self.assertNotEquals(interner.intern([1, 2]), interner.intern(None))
+
+
+class NodeLayersTestCase(unittest.TestCase):
+    def extend_flat(self, selection, named_chain, selection_index,
+                    extensions, mode):
+        # What the layers stand for: one dict, later updates winning.
+        expanded = dict(extensions)
+        expanded.update({"__mode__": mode, "__index__": selection_index})
+        expanded.update(selection)
+        prefix = "_"
+        for ancestor in reversed(named_chain):
+            for k, v in ancestor.iteritems():
+                expanded[prefix + k] = v
+            prefix += "_"
+        return expanded
+
+    def test_extend_matchesFlatDict(self):
+        named_chain = [{"name": "top", "title": "Top"},
+                       {"name": "middle", "_name": "hidden"}]
+        extensions = {"color": "blue", "__mode__": "ignored", "extra": 1}
+        pattern = {"fruit": ["pear"], "color": ["red"], "_name": ["own"]}
+        selection = {"fruit": "pear", "color": "red", "_name": "own"}
+        layers = NodeLayers(named_chain, extensions, "debug", pattern)
+        extended = layers.extend(selection, 7)
+        expected = self.extend_flat(selection, named_chain, 7, extensions,
+                                    "debug")
+        for key, value in expected.iteritems():
+            self.assertEquals(value, extended[key])
+        self.assertEquals("%(__name)s %(_name)s" % expected,
+                          "%(__name)s %(_name)s" % extended)
+        self.assertRaises(KeyError, lambda: extended["missing"])
+
+    def test_writes_stayInTheSelection(self):
+        layers = NodeLayers([{"name": "top"}], {"color": "blue"}, "release",
+                            {"fruit": ["pear"]})
+        first = layers.extend({"fruit": "pear"}, 0)
+        first["color"] = "green"
+        first["_name"] = "changed"
+        second = layers.extend({"fruit": "pear"}, 1)
+        self.assertEquals(("blue", "top"), (second["color"], second["_name"]))
+        self.assertEquals({"color": "blue", "_name": "top",
+                           "__mode__": "release"}, layers.shared)
+
+class WhenConditionTestCase(unittest.TestCase):
+    def condition(self, clauses):
+        return WhenCondition([(Template(first), Template(second))
+                              for first, second in clauses])
+
+    def match_any(self, clauses, values):
+        for first, second in clauses:
+            if first % values == second % values:
+                return True
+        return False
+
+    def test_matches_agreesWithFormatOperator(self):
+        clauses = [["%(color)s", "red"], ["%(size)s-%(fruit)s", "big-pear"],
+                   ["%(count)d", "2"]]
+        condition = self.condition(clauses)
+        for color in ["red", "green"]:
+            for size in ["big", "small"]:
+                for fruit in ["pear", "apple"]:
+                    for count in [1, 2, 2.0, True]:
+                        values = {"color": color, "size": size,
+                                  "fruit": fruit, "count": count}
+                        self.assertEquals(self.match_any(clauses, values),
+                                          condition.matches(values))
+
+    def test_constantClauses_areFolded(self):
+        self.assertTrue(self.condition([["yes", "no"],
+                                        ["%(a)s", "%(a)s"]]).always)
+        condition = self.condition([["yes", "no"], ["a", "b"]])
+        self.assertTrue(condition.never)
+        self.assertFalse(condition.matches({}))
+        condition = self.condition([["yes", "no"], ["%(a)s", "x"]])
+        self.assertEquals(("a",), condition.keys)
+        self.assertFalse(condition.always or condition.never)
+
+    def test_outcome_isRememberedPerValueTuple(self):
+        condition = self.condition([["%(a)s", "x"]])
+        self.assertTrue(condition.matches({"a": "x", "b": 1}))
+        condition._clauses = []
+        self.assertTrue(condition.matches({"a": "x", "b": 2}))
+        self.assertFalse(condition.matches({"a": "y"}))
+
+    def test_numbersAndIndex_areNotRemembered(self):
+        condition = self.condition([["%(a)s", "1"]])
+        self.assertTrue(condition.matches({"a": 1}))
+        self.assertFalse(condition.matches({"a": True}))
+        self.assertFalse(condition.matches({"a": 1.0}))
+        condition = self.condition([["%(__index__)s", "3"]])
+        self.assertTrue(condition.matches({"__index__": 3}))
+        self.assertEquals(None, condition._memo)
+        condition = self.condition([["%(a)r", "u'x'"]])
+        self.assertEquals(None, condition._memo)
+        self.assertTrue(condition.matches({"a": u"x"}))
+        self.assertFalse(condition.matches({"a": "x"}))
+
+if __name__ == '__main__':
+    unittest.main()
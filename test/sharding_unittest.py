@@ -0,0 +1,123 @@
+import test_includes
+import unittest
+import copy
+import generator
+import json
+import os
+import shutil
+import tempfile
+from sharding import ShardWriter, ShardError, merge_shards, parse_shard, \
+                     shard_range
+
+class MockWriter(object):
+    def __init__(self):
+        self.fs = {}
+        self.log = []
+
+    def write(self, filename, content):
+        self.fs[filename] = content
+        self.log.append(filename)
+
+    def close(self):
+        pass
+
+class ShardingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.spec = {"scenarios": [{"fruit": "*", "color": "*", "size": "*"},
+                                   {"fruit": "pear", "color": "*",
+                                    "size": "big"}],
+                     "skip": [{"fruit": "apple", "color": "red",
+                               "size": "*"}]}
+        self.schema = {
+          "/scenarios/*": {
+            "matches": "@scenario_schema",
+            "action": "generate",
+            "path": "%(fruit)s/%(color)s-%(size)s.html",
+            "template": "%(__index__)s"
+          },
+          "/skip/*": {
+            "matches": "@scenario_schema",
+            "action": "suppress"
+          },
+          "#scenario_schema": {
+            "fruit": ["apple", "pear", "lemon"],
+            "color": ["red", "green", "yellow"],
+            "size": ["small", "big"]
+          }
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def generate(self, shard=None):
+        manifest_path = os.path.join(self.directory, "shard-%s.json" %
+                                     (shard[0] if shard else "all"))
+        writer = ShardWriter(MockWriter(), manifest_path, shard or (0, 1),
+                             "inputs")
+        g = generator.Generator(copy.deepcopy(self.spec), self.schema,
+                                writer=writer, shard=shard)
+        g.generate()
+        writer.close()
+        writer.save(g.selection_range, g.selection_count)
+        with open(manifest_path) as f:
+            return writer.writer, json.load(f)
+
+    def test_parseShard(self):
+        self.assertEquals((2, 5), parse_shard("2/5"))
+        for text in ["5/5", "-1/2", "1/0", "1", "a/b", "1/2/3"]:
+            self.assertRaises(ValueError, parse_shard, text)
+
+    def test_shardRanges_coverAllIndices(self):
+        for total in [0, 1, 7, 100]:
+            for count in [1, 2, 3, 8]:
+                ranges = [shard_range(i, count, total)
+                          for i in range(0, count)]
+                self.assertEquals(0, ranges[0][0])
+                self.assertEquals(total, ranges[-1][1])
+                for i in range(1, count):
+                    self.assertEquals(ranges[i - 1][1], ranges[i][0])
+
+    def test_shards_addUpToUnshardedRun(self):
+        whole, manifest = self.generate()
+        for count in [1, 2, 3, 5, 24]:
+            merged = {}
+            log = []
+            manifests = []
+            for index in range(0, count):
+                writer, manifest = self.generate((index, count))
+                merged.update(writer.fs)
+                log.extend(writer.log)
+                manifests.append(manifest)
+            # The same __index__ values and writes as the unsharded run.
+            self.assertEquals(whole.log, log)
+            self.assertEquals(whole.fs, merged)
+            files = merge_shards(list(reversed(manifests)))
+            self.assertEquals(sorted(whole.fs.keys()), sorted(files.keys()))
+
+    def test_collidingPath_isTakenFromLastShard(self):
+        writers = []
+        manifests = []
+        for index in range(0, 2):
+            writer, manifest = self.generate((index, 2))
+            writers.append(writer)
+            manifests.append(manifest)
+        # The second scenario overwrites pear/*-big.html of the first one.
+        self.assertTrue("pear/red-big.html" in writers[0].fs)
+        self.assertTrue("pear/red-big.html" in writers[1].fs)
+        digest, index = merge_shards(manifests)["pear/red-big.html"]
+        self.assertEquals(1, index)
+        self.assertEquals(manifests[1]["files"]["pear/red-big.html"], digest)
+
+    def test_merge_reportsMissingAndForeignShards(self):
+        manifests = [self.generate((index, 3))[1] for index in range(0, 3)]
+        self.assertRaises(ShardError, merge_shards, manifests[:2])
+        self.assertRaises(ShardError, merge_shards,
+                          manifests + [manifests[1]])
+        foreign = dict(manifests[2], inputs="other")
+        self.assertRaises(ShardError, merge_shards,
+                          manifests[:2] + [foreign])
+        self.assertRaises(ShardError, merge_shards, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import test_includes
+import unittest
+import generator
+import json
+import os
+import shutil
+import tempfile
+from streaming import StreamedSpec, StreamedArray, StreamError
+
+class MockWriter(object):
+    def __init__(self):
+        self.fs = {}
+        self.log = []
+
+    def write(self, filename, content):
+        self.fs[filename] = content
+        self.log.append(filename)
+
+class StreamedSpecTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "spec.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_spec(self, content):
+        with open(self.filename, "w") as f:
+            f.write(content)
+
+    def test_items_matchLoadedJson(self):
+        spec = {"title": u"Fruit \u00e9", "version": 12.5,
+                "scenarios": [{"fruit": "pear", "weight": 1234567},
+                              [1, 2.25, None, True], "apple", -3e10],
+                "empty": [], "nested": {"list": [1, 2]}}
+        self.write_spec(json.dumps(spec, indent=1))
+        # Small chunks make values and numbers span several reads.
+        for chunk_size in [1, 2, 3, 7, 64, 65536]:
+            streamed = StreamedSpec(self.filename, chunk_size=chunk_size)
+            items = {}
+            for key, value in streamed.items():
+                if isinstance(value, StreamedArray):
+                    value = list(value)
+                items[key] = value
+            self.assertEquals(spec, items)
+            self.assertEquals(spec["scenarios"],
+                              list(streamed.entries("scenarios")))
+
+    def test_items_keepFileOrder(self):
+        self.write_spec('{"b": 1, "a": [1, 2], "c": {"d": []}}')
+        keys = [key for key, value
+                in StreamedSpec(self.filename).items(lambda key: False)]
+        self.assertEquals(["b", "a", "c"], keys)
+
+    def test_unreadArray_isSkipped(self):
+        self.write_spec('{"a": [{"x": 1}, {"x": 2}], "b": 2}')
+        items = list(StreamedSpec(self.filename, chunk_size=4).items())
+        self.assertEquals("b", items[1][0])
+        self.assertEquals(2, items[1][1])
+
+    def test_invalidJson_reportsLocation(self):
+        self.write_spec('{"a": [\n  {"x": 1},\n  {"x": 2,}\n]}')
+        streamed = StreamedSpec(self.filename, chunk_size=5)
+        try:
+            list(streamed.entries("a"))
+            self.fail("StreamError not raised")
+        except StreamError, err:
+            self.assertTrue("Line 3 column 11" in err.message)
+
+    def test_notAnObject_raises(self):
+        self.write_spec('[1, 2]')
+        self.assertRaises(StreamError, list,
+                          StreamedSpec(self.filename).items())
+
+class StreamedGenerationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "spec.json")
+        self.spec = {"title": "Fruit",
+                     "scenarios": [{"fruit": "*", "color": "*"},
+                                   {"fruit": "pear", "color": "red"},
+                                   {"fruit": "*", "color": "green"}],
+                     "skip": [{"fruit": "apple", "color": "*"}]}
+        self.schema = {
+          "matches": {"title": "non_empty_string",
+                      "scenarios": "non_empty_list",
+                      "skip": "non_empty_list"},
+          "/scenarios/*": {
+            "matches": {"fruit": ["apple", "pear", "lemon"],
+                        "color": ["red", "green"]},
+            "action": "generate",
+            "path": "%(fruit)s-%(color)s.html",
+            "template": "%(__index__)s: %(color)s %(fruit)s"
+          },
+          "/skip/*": {
+            "matches": {"fruit": ["apple", "pear", "lemon"],
+                        "color": ["red", "green"]},
+            "action": "suppress"
+          }
+        }
+        with open(self.filename, "w") as f:
+            json.dump(self.spec, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_streamedSpec_matchesLoadedSpec(self):
+        loaded = generator.Generator(self.spec, self.schema,
+                                     writer=MockWriter())
+        loaded.generate()
+        streamed = generator.Generator(StreamedSpec(self.filename,
+                                                    chunk_size=16),
+                                       self.schema, writer=MockWriter())
+        streamed.generate()
+        self.assertEquals(loaded.writer.log, streamed.writer.log)
+        self.assertEquals(loaded.writer.fs, streamed.writer.fs)
+        self.assertEquals("6: red pear", streamed.writer.fs["pear-red.html"])
+
+    def test_invalidEntry_raisesSpecError(self):
+        self.spec["scenarios"][1]["fruit"] = "plum"
+        with open(self.filename, "w") as f:
+            json.dump(self.spec, f)
+        error_details = {}
+        g = generator.Generator(StreamedSpec(self.filename), self.schema,
+                                writer=MockWriter())
+        self.assertRaises(generator.SpecError, g.generate,
+                          error_details=error_details)
+        self.assertEquals("/scenarios/*", error_details["path"])
+        self.assertEquals({}, g.writer.fs)
+
+if __name__ == '__main__':
+    unittest.main()
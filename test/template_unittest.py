@@ -0,0 +1,90 @@
+import test_includes
+import unittest
+from template import Template, RenderCache
+
+class TemplateTestCase(unittest.TestCase):
+    def test_placeholders_areParsedIntoSlots(self):
+        t = Template("%(_name)s/%(color)s-%(fruit)s.html")
+        self.assertEquals(frozenset(["_name", "color", "fruit"]), t.keys)
+        self.assertEquals(["", "/", "-", ".html"], t.literals)
+        self.assertFalse(t.is_constant)
+
+    def test_render_matchesFormatOperator(self):
+        values = {"a": u"apple", "n": 7, "x": None, "f": 1.5}
+        for source in ["%(a)s and %(a)s", "%(n)03d|%(n)-4d|", "%(x)s",
+                       "%(f).2f %(a)r", "100%% %(a)s", "%(n)x%(n)o"]:
+            self.assertEquals(source % values, Template(source).render(values))
+
+    def test_noPlaceholders_isConstant(self):
+        t = Template("Enable: 100%%")
+        self.assertTrue(t.is_constant)
+        self.assertEquals(frozenset(), t.keys)
+        self.assertEquals("Enable: 100%", t.render({}))
+
+    def test_positionalSpecifier_fallsBackToFormatOperator(self):
+        t = Template("%s")
+        self.assertFalse(t.is_constant)
+        self.assertEquals(str({"a": 1}), t.render({"a": 1}))
+
+    def test_missingKey_raisesKeyError(self):
+        self.assertRaises(KeyError, Template("%(a)s").render, {})
+
+    def test_invalidTemplate_raisesValueError(self):
+        for source in ["%(a)y", "abc %", "%(a"]:
+            try:
+                source % {"a": 1}
+            except ValueError, err:
+                expected_message = err.message
+            try:
+                Template(source)
+                self.fail("Expected ValueError for %s" % source)
+            except ValueError, err:
+                self.assertEquals(expected_message, err.message)
+
+class RenderCacheTestCase(unittest.TestCase):
+    def test_output_isReusedForSameReferencedValues(self):
+        cache = RenderCache()
+        t = Template("%(fruit)s is %(color)s")
+        self.assertEquals("pear is green", cache.render(
+            t, {"fruit": "pear", "color": "green", "size": "big"}))
+        self.assertEquals("pear is green", cache.render(
+            t, {"fruit": "pear", "color": "green", "size": "small"}))
+        self.assertEquals("pear is red", cache.render(
+            t, {"fruit": "pear", "color": "red", "size": "small"}))
+        self.assertEquals((1, 2), (cache.hits, cache.misses))
+
+    def test_leastRecentlyUsed_isEvicted(self):
+        cache = RenderCache(limit=2)
+        t = Template("%(a)s")
+        for value in ["x", "y", "x", "z", "x", "y"]:
+            self.assertEquals(value, cache.render(t, {"a": value}))
+        # y was evicted by z, x stayed as it was used in between.
+        self.assertEquals((2, 4), (cache.hits, cache.misses))
+        self.assertEquals(2, len(cache))
+
+    def test_valuesRenderingDifferently_areNotKept(self):
+        cache = RenderCache()
+        t = Template("%(a)s")
+        for value in [1, True, 1.0, "1", [1]]:
+            self.assertEquals("%s" % (value,), cache.render(t, {"a": value}))
+        self.assertEquals(1, len(cache))
+        for source in ["%(__index__)s", "%(a)r", "%(a)d", "%s", "constant"]:
+            self.assertFalse(cache.caches(Template(source)))
+
+    def test_templateMissingMostly_isNoLongerKept(self):
+        cache = RenderCache()
+        cache.probe_misses = 4
+        t = Template("%(a)s")
+        for value in ["1", "2", "1", "3", "4"]:
+            cache.render(t, {"a": value})
+        self.assertFalse(cache.caches(t))
+        self.assertEquals("1", cache.render(t, {"a": "1"}))
+        self.assertEquals((1, 4), (cache.hits, cache.misses))
+
+        t = Template("%(b)s")
+        for value in ["1", "1", "1", "1", "1", "2", "3", "4", "5"]:
+            cache.render(t, {"b": value})
+        self.assertTrue(cache.caches(t))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import test_includes
+import unittest
+import re
+from util import PathInterner, normalize_path
+
+class PathInternerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.paths = PathInterner()
+
+    def generalize(self, path):
+        parts = [re.sub('^[0-9]+$', '*', part) for part in path.split('/')]
+        return '/' + '/'.join(filter(None, parts))
+
+    def test_child_matchesNormalizedPath(self):
+        for path in ["/", "/scenarios", "/groups/0/scenarios"]:
+            for key in ["fruit", 3, "12", "a/b", "/c/", ""]:
+                self.assertEquals(normalize_path(path + "/" + str(key)),
+                                  self.paths.child(path, key))
+                self.assertEquals(normalize_path(path + "/" + str(key)),
+                                  self.paths.join(path, key))
+
+    def test_genericChild_replacesIntegerSegments(self):
+        for path in ["/", "/groups/3", "/groups/3/scenarios"]:
+            for key in ["fruit", 3, "12", "a/7", ""]:
+                self.assertEquals(
+                    self.generalize(path + "/" + str(key)),
+                    self.paths.generic_child(self.generalize(path), key))
+
+    def test_genericPaths_areInterned(self):
+        first = self.paths.generic_child("/scenarios", 0)
+        second = self.paths.generic_child("/scenarios", 1)
+        self.assertEquals("/scenarios/*", first)
+        self.assertTrue(first is second)
+        self.assertTrue(first is self.paths.generalize("/scenarios/5"))
+
+    def test_generalize_matchesSplittingThePath(self):
+        for path in ["/", "", "//a//0/", "/groups/0/scenarios/12/x1"]:
+            self.assertEquals(self.generalize(path),
+                              self.paths.generalize(path))
+
+if __name__ == '__main__':
+    unittest.main()
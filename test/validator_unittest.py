@@ -1,5 +1,6 @@
 import test_includes
 import unittest
+import assertion
 import validator
 from validator import SchemaError, SpecError
 
@@ -407,5 +408,102 @@ class ValidatorTestCase(unittest.TestCase):
                  "#mapper_keys": ["a", "b"]}
         self.assert_valid(spec, schema)
 
+class FileCheckTestCase(unittest.TestCase):
+    def setUp(self):
+        self.isfile = assertion.os.path.isfile
+        self.stats = []
+        def isfile(filename):
+            self.stats.append(filename)
+            return self.isfile(filename)
+        assertion.os.path.isfile = isfile
+        assertion.clear_file_exists_cache()
+
+    def tearDown(self):
+        assertion.os.path.isfile = self.isfile
+        assertion.clear_file_exists_cache()
+
+    def test_missingFiles_areReportedTogether(self):
+        import os
+        spec = {"files": {"a": os.path.realpath(__file__),
+                          "b": "/nonexistent/b.py",
+                          "c": "/nonexistent/c.py"}}
+        schema = {"/files": {"each_value": "existing_file"}}
+        error_details = {}
+        v = validator.Validator(spec, schema)
+        with self.assertRaises(SpecError) as context:
+            v.validate(error_details=error_details)
+        lines = sorted(str(context.exception).splitlines())
+        self.assertEquals(['Field "b" must be an existing file: '
+                           '/nonexistent/b.py (at /files)',
+                           'Field "c" must be an existing file: '
+                           '/nonexistent/c.py (at /files)'], lines)
+        self.assertEquals("/files", error_details["path"])
+        self.assertEquals(["/nonexistent/b.py", "/nonexistent/c.py"],
+                          sorted(error_details["missing_files"]))
+
+    def test_duplicateFiles_areCheckedOncePerProcess(self):
+        import os
+        filename = os.path.realpath(__file__)
+        spec = {"files": [filename, filename, filename]}
+        schema = {"/files": {"each_value": "existing_file"}}
+        validator.Validator(spec, schema).validate()
+        validator.Validator(spec, schema).validate()
+        self.assertEquals([filename], self.stats)
+
+    def test_threadPool_givesSameResults(self):
+        import os
+        filenames = [os.path.realpath(__file__), "/nonexistent/a",
+                     "/nonexistent/b"]
+        exists = assertion.files_exist(filenames, threads=3)
+        self.assertEquals({filenames[0]: True, filenames[1]: False,
+                           filenames[2]: False}, exists)
+        self.assertEquals(3, len(self.stats))
+
+class CompiledSchemaTestCase(unittest.TestCase):
+    def createSchema(self):
+        return {"/specification": {
+                    "/*": {
+                        "matches": {"name": "non_empty_string",
+                                    "fruit": "@fruit_schema"}
+                    }
+                },
+                "/unused": {
+                    "each_value": "@missing_schema"
+                },
+                "#fruit_schema": ["apple", "pear"]}
+
+    def test_compiledSchema_validatesManySpecs(self):
+        compiled = validator.CompiledSchema(self.createSchema())
+        valid = {"specification": [{"name": "a", "fruit": "pear"}]}
+        invalid = {"specification": [{"name": "b", "fruit": "lemon"}]}
+
+        v = validator.Validator(valid, compiled)
+        v.validate()
+        self.assertEquals(["apple", "pear"],
+                          v.meta_schema_map["/specification/*/fruit"])
+
+        error_details = {}
+        v = validator.Validator(invalid, compiled)
+        with self.assertRaises(SpecError) as context:
+            v.validate(error_details=error_details)
+        self.assertEquals('Field "fruit" must be from: [\'*\', \'apple\', '
+                          '\'pear\']', str(context.exception))
+        self.assertEquals("/specification/*", error_details["path"])
+        self.assertEquals({"name": "non_empty_string",
+                           "fruit": "@fruit_schema"},
+                          error_details["expectation"])
+
+    def test_schemaErrors_areRaisedWhenReached(self):
+        compiled = validator.CompiledSchema(self.createSchema())
+        validator.Validator({"specification": [{"name": "a",
+                                                "fruit": "apple"}]},
+                            compiled).validate()
+        v = validator.Validator({"specification": [], "unused": ["x"]},
+                                compiled)
+        with self.assertRaises(SchemaError) as context:
+            v.validate()
+        self.assertEquals("Invalid meta schema reference '@missing_schema'",
+                          str(context.exception))
+
 if __name__ == '__main__':
     unittest.main()
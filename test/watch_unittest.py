@@ -0,0 +1,192 @@
+import test_includes
+import unittest
+import generator
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from StringIO import StringIO
+from watch import Watcher, signature
+
+class Options(object):
+    """The parsed command line options."""
+
+    def __init__(self, **options):
+        self.__dict__.update(options)
+
+class ScriptedWatcher(Watcher):
+    """Makes the next edit instead of waiting for one."""
+
+    def __init__(self, edits):
+        Watcher.__init__(self)
+        self.edits = list(edits)
+
+    def wait(self):
+        self.edits.pop(0)()
+        return self.changes()
+
+class WatcherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "spec.json")
+        self.write(self.path, "{}")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, path, content):
+        with open(path, "w") as f:
+            f.write(content)
+
+    def test_changes_reportsModifiedAndAddedFiles(self):
+        watcher = Watcher()
+        watcher.watch({self.path: signature(self.path)})
+        self.assertEquals([], watcher.changes())
+        self.write(os.path.join(self.directory, "added.template"), "")
+        self.assertEquals([self.directory], watcher.changes())
+        self.write(self.path, '{"scenarios": []}')
+        self.assertEquals([self.directory, self.path], watcher.changes())
+
+    def test_changeAfterReading_isReportedAtOnce(self):
+        read_at = signature(self.path)
+        self.write(self.path, '{"scenarios": []}')
+        watcher = Watcher()
+        watcher.watch({self.path: read_at})
+        self.assertEquals([self.path], watcher.wait())
+        os.remove(self.path)
+        watcher.watch({self.path: None})
+        self.assertEquals([], watcher.changes())
+
+class WatchGeneratorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output = os.path.join(self.directory, "out")
+        os.mkdir(self.output)
+        self.cwd = os.getcwd()
+        os.chdir(self.output)
+        self.spec = os.path.join(self.directory, "spec.json")
+        self.schema = os.path.join(self.directory, "schema.json")
+        self.template = os.path.join(self.directory, "fruit.template")
+        self.write(self.spec, {"scenarios": [{"fruit": "*"}]})
+        self.write(self.schema, {
+          "/scenarios/*": {
+            "matches": {"fruit": ["pear", "lemon"]},
+            "action": "generate",
+            "path": "%(fruit)s.html",
+            "template": {"__main__": "fruit.template"}
+          }
+        })
+        self.edit_template("Fruit: %(fruit)s")
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def write(self, path, content):
+        with open(path, "w") as f:
+            if isinstance(content, basestring):
+                f.write(content)
+            else:
+                json.dump(content, f)
+
+    def edit_template(self, content):
+        self.write(self.template, content)
+
+    def read(self, filename):
+        with open(os.path.join(self.output, filename)) as f:
+            return f.read()
+
+    def watch(self, edits, **options):
+        args = Options(
+            spec=self.spec, schema=self.schema, dryrun=False, target="release",
+            log_level="quiet", events=None, profile=None,
+            file_check_threads=0, plan=False, max_outputs=None,
+            max_bytes=None, jobs=1, write_threads=0, manifest=None,
+            prune=False, incremental=None, stream=False, shard=None,
+            shard_manifest=None, output_archive=None, dedup=False, watch=0)
+        args.__dict__.update(options)
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            generator.watch_generator(args, watcher=ScriptedWatcher(edits),
+                                      cycles=len(edits) + 1)
+            return sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+    def test_cycles_followTemplateAndSpecEdits(self):
+        log = self.watch([
+            lambda: self.edit_template("Fruit: %(fruit)s, %(__mode__)s"),
+            lambda: self.write(self.spec, {"scenarios": [{"fruit": "pear"}]}),
+        ])
+        self.assertEquals("Fruit: pear, release", self.read("pear.html"))
+        self.assertEquals("Fruit: lemon, release", self.read("lemon.html"))
+        self.assertTrue("Cycle 2 done" in log)
+        self.assertTrue("after changes to ../fruit.template" in log)
+        self.assertTrue("Cycle 3 done" in log)
+        self.assertEquals(3, log.count("Reused 0 of 1 expansion nodes"))
+
+    def test_unchangedNodes_areReused(self):
+        self.write(self.spec, {"scenarios": [{"fruit": "pear"},
+                                             {"fruit": "lemon"}]})
+        log = self.watch([
+            lambda: self.write(self.spec, {"scenarios": [{"fruit": "pear"},
+                                                         {"fruit": "pear"}]}),
+        ])
+        self.assertTrue("Reused 1 of 2 expansion nodes" in log)
+        self.assertEquals("Fruit: pear", self.read("pear.html"))
+
+    def test_errors_keepWatching(self):
+        with open(self.schema) as f:
+            schema = json.load(f)
+        bogus = json.loads(json.dumps(schema))
+        bogus["/scenarios/*"]["bogus_rule"] = 1
+        log = self.watch([
+            lambda: self.write(self.spec, "{ broken"),
+            lambda: self.write(self.spec, {"scenarios": [{"fruit": "apple"}]}),
+            lambda: self.write(self.spec, {"scenarios": [{"fruit": "pear"}]}),
+            lambda: self.write(self.schema, bogus),
+            lambda: self.write(self.schema, []),
+            lambda: self.write(self.schema, schema),
+        ])
+        self.assertTrue("Cycle 2 failed" in log)
+        self.assertTrue("Spec Error" in log)
+        self.assertTrue("Cycle 3 failed" in log)
+        self.assertTrue("Cycle 4 done" in log)
+        self.assertTrue("Cycle 5 failed" in log)
+        self.assertTrue("Schema Error" in log)
+        self.assertTrue("Cycle 6 failed" in log)
+        self.assertTrue("Cycle 7 done" in log)
+        self.assertEquals("Fruit: pear", self.read("pear.html"))
+
+    def test_failedCycles_stopTheWriterThreads(self):
+        self.write(self.schema, {
+          "/scenarios/*": {
+            "matches": {"fruit": ["pear", "lemon"]},
+            "action": "generate",
+            "path": "%(fruit)s.html",
+            "template": {"__main__": "%(fruit)s.template"}
+          }
+        })
+        pear = os.path.join(self.directory, "pear.template")
+        lemon = os.path.join(self.directory, "lemon.template")
+        self.write(pear, "Pear")
+        self.write(lemon, "Lemon")
+        threads = threading.active_count()
+        after_failure = []
+        log = self.watch([
+            lambda: os.remove(lemon),
+            lambda: (after_failure.append(threading.active_count()),
+                     self.write(lemon, "Lemon")),
+        ], write_threads=4)
+        self.assertTrue("Cycle 2 failed" in log)
+        self.assertTrue("Read Error" in log)
+        self.assertTrue("Cycle 3 done" in log)
+        self.assertEquals([threads], after_failure)
+        self.assertEquals(threads, threading.active_count())
+        self.assertEquals("Lemon", self.read("lemon.html"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,296 @@
+import test_includes
+import unittest
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+import writer as writer_module
+from writer import OutputWriter, ManifestWriter, ThreadedWriter, \
+                   ArchiveWriter, DedupWriter
+
+class CountingWriter(OutputWriter):
+    def __init__(self):
+        OutputWriter.__init__(self)
+        self.filenames = []
+
+    def write(self, filename, content):
+        self.filenames.append(filename)
+        OutputWriter.write(self, filename, content)
+
+class ManifestWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.manifest_path = os.path.join(self.directory, "manifest.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def run_writer(self, files, prune=False):
+        writer = ManifestWriter(CountingWriter(), self.manifest_path,
+                                prune=prune)
+        for filename, content in files:
+            writer.write(self.path(filename), content)
+        writer.close()
+        return writer
+
+    def test_unchangedFiles_areNotRewritten(self):
+        self.run_writer([("a/1.html", "one"), ("a/2.html", u"two")])
+        writer = self.run_writer([("a/1.html", "one"), ("a/2.html", u"2")])
+        self.assertEquals([self.path("a/2.html")], writer.writer.filenames)
+        self.assertEquals(1, writer.written)
+        self.assertEquals(1, writer.unchanged)
+        with open(self.path("a/2.html")) as f:
+            self.assertEquals("2", f.read())
+
+    def test_missingFile_isRewritten(self):
+        self.run_writer([("1.html", "one")])
+        os.remove(self.path("1.html"))
+        writer = self.run_writer([("1.html", "one")])
+        self.assertEquals(1, writer.written)
+        self.assertTrue(os.path.isfile(self.path("1.html")))
+
+    def test_collidingWrites_keepLastContent(self):
+        self.run_writer([("1.html", "one")])
+        writer = self.run_writer([("1.html", "two"), ("1.html", "one")])
+        self.assertEquals(2, writer.written)
+        with open(self.path("1.html")) as f:
+            self.assertEquals("one", f.read())
+
+    def test_staleFiles_areReportedAndPruned(self):
+        self.run_writer([("1.html", "one"), ("2.html", "two")])
+        writer = self.run_writer([("1.html", "one")])
+        self.assertEquals([self.path("2.html")], writer.stale)
+        self.assertTrue(os.path.isfile(self.path("2.html")))
+
+        writer = self.run_writer([("1.html", "one")], prune=True)
+        self.assertEquals([self.path("2.html")], writer.stale)
+        self.assertFalse(os.path.isfile(self.path("2.html")))
+        self.assertEquals("Written: 0, unchanged: 1, stale: 1 (pruned)",
+                          writer.report())
+
+class DirectoryCountingWriter(ThreadedWriter):
+    def __init__(self, *args, **kwargs):
+        ThreadedWriter.__init__(self, *args, **kwargs)
+        self.directories = []
+
+    def _make_directory(self, full_path):
+        if not full_path in self._directories:
+            self.directories.append(full_path)
+        ThreadedWriter._make_directory(self, full_path)
+
+class ThreadedWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, *parts):
+        return os.path.join(self.directory, *parts)
+
+    def test_writes_areCompletedOnClose(self):
+        writer = DirectoryCountingWriter(threads=3, batch_size=4)
+        for i in range(0, 50):
+            writer.write(self.path("a", "b", "%d.html" % i), str(i))
+            writer.write(self.path("a", "%d.html" % i), str(i))
+        writer.close()
+        for i in range(0, 50):
+            with open(self.path("a", "b", "%d.html" % i)) as f:
+                self.assertEquals(str(i), f.read())
+        self.assertTrue(len(writer.directories) <= 2 * writer.threads)
+
+    def test_collidingWrites_keepOrder(self):
+        writer = ThreadedWriter(threads=4, batch_size=2)
+        for i in range(0, 100):
+            writer.write(self.path("same.html"), str(i))
+            writer.write(self.path("%d.html" % i), str(i))
+        writer.flush()
+        with open(self.path("same.html")) as f:
+            self.assertEquals("99", f.read())
+        writer.close()
+
+    def test_writeError_isRaisedOnClose(self):
+        with open(self.path("file"), "w") as f:
+            f.write("")
+        writer = ThreadedWriter(threads=2, batch_size=8)
+        writer.write(self.path("file", "1.html"), "1")
+        writer.write(self.path("2.html"), "2")
+        self.assertRaises(OSError, writer.close)
+        self.assertEquals([], writer._workers)
+
+    def test_abort_stopsThreadsWithoutRaising(self):
+        with open(self.path("file"), "w") as f:
+            f.write("")
+        writer = ThreadedWriter(threads=2, batch_size=8)
+        writer.write(self.path("file", "1.html"), "1")
+        writer.write(self.path("2.html"), "2")
+        writer.abort()
+        self.assertEquals([], writer._workers)
+
+
+class ArchiveWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.files = [("a/1.html", "one"), ("b/2.html", u"two \u00e9"),
+                      ("a/1.html", "last")]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_writer(self, name):
+        archive_path = os.path.join(self.directory, name)
+        writer = ArchiveWriter(archive_path)
+        for filename, content in self.files:
+            writer.write(filename, content)
+        writer.close()
+        return archive_path
+
+    def test_tar_keepsWriteOrderAndLastContent(self):
+        for name in ["out.tar", "out.tar.gz", "out.tbz2"]:
+            archive = tarfile.open(self.run_writer(name))
+            self.assertEquals(["a/1.html", "b/2.html", "a/1.html"],
+                              archive.getnames())
+            self.assertEquals("last",
+                              archive.extractfile("a/1.html").read())
+            self.assertEquals(u"two \u00e9".encode("utf-8"),
+                              archive.extractfile("b/2.html").read())
+            member = archive.getmember("b/2.html")
+            self.assertEquals((0644, 315532800), (member.mode, member.mtime))
+            archive.close()
+
+    def test_zip_keepsLastContent(self):
+        archive = zipfile.ZipFile(self.run_writer("out.zip"))
+        self.assertEquals("last", archive.read("a/1.html"))
+        self.assertEquals((1980, 1, 1, 0, 0, 0),
+                          archive.getinfo("b/2.html").date_time)
+        archive.close()
+
+    def test_sameOutputs_giveSameArchive(self):
+        for name in ["out.tar.gz", "out.zip"]:
+            with open(self.run_writer(name), "rb") as f:
+                first = f.read()
+            os.remove(os.path.join(self.directory, name))
+            with open(self.run_writer(name), "rb") as f:
+                self.assertEquals(first, f.read())
+
+    def test_previousArchive_isReplacedOnClose(self):
+        archive_path = self.run_writer("out.tar.gz")
+        with open(archive_path, "rb") as f:
+            previous = f.read()
+        writer = ArchiveWriter(archive_path)
+        writer.write("c/3.html", "three")
+        with open(archive_path, "rb") as f:
+            self.assertEquals(previous, f.read())
+        writer.abort()
+        with open(archive_path, "rb") as f:
+            self.assertEquals(previous, f.read())
+        self.assertEquals(["out.tar.gz"], os.listdir(self.directory))
+
+        umask = os.umask(0)
+        os.umask(umask)
+        self.files = []
+        self.run_writer("out.tar.gz")
+        self.assertEquals([], tarfile.open(archive_path).getnames())
+        self.assertEquals(0666 & ~umask,
+                          os.stat(archive_path).st_mode & 0777)
+        self.assertEquals(["out.tar.gz"], os.listdir(self.directory))
+
+    def test_unknownFormat_raises(self):
+        self.assertRaises(ValueError, ArchiveWriter,
+                          os.path.join(self.directory, "out.rar"))
+        if writer_module.lzma is None:
+            self.assertRaises(ValueError, ArchiveWriter,
+                              os.path.join(self.directory, "out.tar.xz"))
+
+    def test_tarDedup_linksIdenticalMembers(self):
+        self.files = [("a/1.html", "same"), ("b/2.html", "same"),
+                      ("a/1.html", "other"), ("c/3.html", "same")]
+        archive_path = os.path.join(self.directory, "out.tar")
+        writer = ArchiveWriter(archive_path, dedup=True)
+        for filename, content in self.files:
+            writer.write(filename, content)
+        writer.close()
+        self.assertEquals((2, 8), (writer.index.links,
+                                   writer.index.saved_bytes))
+        archive = tarfile.open(archive_path)
+        members = archive.getmembers()
+        self.assertTrue(members[1].islnk())
+        self.assertEquals("a/1.html", members[1].linkname)
+        # a/1.html no longer holds "same" once it is rewritten.
+        self.assertEquals("b/2.html", members[3].linkname)
+        archive.close()
+
+    def test_tarDedup_extractsToSameFiles(self):
+        self.files = [("a/1.html", "same"), ("b/2.html", "same"),
+                      ("c/3.html", "other")]
+        archive_path = os.path.join(self.directory, "out.tar.gz")
+        writer = ArchiveWriter(archive_path, dedup=True)
+        for filename, content in self.files:
+            writer.write(filename, content)
+        writer.close()
+        extracted = os.path.join(self.directory, "extracted")
+        archive = tarfile.open(archive_path)
+        archive.extractall(extracted)
+        archive.close()
+        for filename, content in self.files:
+            with open(os.path.join(extracted, filename)) as f:
+                self.assertEquals(content, f.read())
+
+class DedupWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def read(self, filename):
+        with open(self.path(filename)) as f:
+            return f.read()
+
+    def test_identicalContent_isLinked(self):
+        writer = DedupWriter()
+        writer.write(self.path("a/1.html"), "same")
+        writer.write(self.path("b/2.html"), u"same")
+        writer.write(self.path("b/3.html"), "other")
+        self.assertEquals(os.stat(self.path("a/1.html")).st_ino,
+                          os.stat(self.path("b/2.html")).st_ino)
+        self.assertEquals(1, os.stat(self.path("b/3.html")).st_nlink)
+        self.assertEquals((1, 4), (writer.index.links,
+                                   writer.index.saved_bytes))
+
+    def test_laterRunWithoutDedup_leavesLinkedFilesAlone(self):
+        for writer in [OutputWriter(), ThreadedWriter(threads=2)]:
+            dedup = DedupWriter()
+            dedup.write(self.path("a"), "same")
+            dedup.write(self.path("b"), "same")
+            writer.write(self.path("b"), "same")
+            writer.write(self.path("a"), "changed")
+            writer.close()
+            self.assertEquals("changed", self.read("a"))
+            self.assertEquals("same", self.read("b"))
+            self.assertEquals(1, os.stat(self.path("a")).st_nlink)
+
+    def test_rewrittenLink_leavesOtherFilesAlone(self):
+        writer = DedupWriter()
+        writer.write(self.path("1.html"), "same")
+        writer.write(self.path("2.html"), "same")
+        writer.write(self.path("1.html"), "other")
+        writer.write(self.path("3.html"), "same")
+        self.assertEquals("other", self.read("1.html"))
+        self.assertEquals("same", self.read("2.html"))
+        self.assertEquals("same", self.read("3.html"))
+        self.assertEquals(os.stat(self.path("2.html")).st_ino,
+                          os.stat(self.path("3.html")).st_ino)
+        # A later run writing over links does not change the other files.
+        DedupWriter().write(self.path("2.html"), "changed")
+        self.assertEquals("same", self.read("3.html"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,4 @@
-import re, json, sys
+import re, json, sys, hashlib
 
 def get_template(basename):
     with open(os.path.join(template_directory, basename)) as f:
@@ -35,6 +35,89 @@ def load_json(path_to_file):
 def normalize_path( path):
         return '/' + '/'.join(filter(None, path.split('/')))
 
+class PathInterner(object):
+    """Builds the paths of the nodes met while walking a spec from the path
+       of their parent and their key, instead of normalizing whole paths.
+
+       The generic form of a path has its integer segments replaced by "*".
+       Generic paths and joined paths are cached and the same string object
+       is returned for the same path, so the number of distinct strings is
+       bounded by the schema rather than by the size of the spec. Concrete
+       paths are not cached, there is one per node, and only paths of the
+       schema should be given to generalize()."""
+
+    _re_integer = re.compile('^[0-9]+$')
+
+    def __init__(self):
+        self._segments = {}
+        self._generic_segments = {}
+        self._joined = {}
+        self._generic_children = {}
+        self._generic_paths = {}
+        self._generalized = {}
+
+    def _segment(self, key):
+        segment = self._segments.get(key)
+        if segment is None:
+            text = key if isinstance(key, basestring) else str(key)
+            segment = '/'.join(filter(None, text.split('/')))
+            self._segments[key] = segment
+        return segment
+
+    def _generic_segment(self, key):
+        if isinstance(key, (int, long)):
+            return "*"
+        segment = self._generic_segments.get(key)
+        if segment is None:
+            segment = '/'.join(["*" if self._re_integer.match(part) else part
+                                for part in self._segment(key).split('/')])
+            self._generic_segments[key] = segment
+        return segment
+
+    def _concatenate(self, path, segment):
+        if not segment:
+            return path
+        if path == "/":
+            return "/" + segment
+        return path + "/" + segment
+
+    def child(self, path, key):
+        """Returns the normalized path of the key under the normalized
+           path."""
+        if isinstance(key, (int, long)):
+            return self._concatenate(path, str(key))
+        return self._concatenate(path, self._segment(key))
+
+    def join(self, path, key):
+        """Same as child(), cached for paths which repeat, such as the
+           generic paths the validator walks."""
+        joined_key = (path, key)
+        joined = self._joined.get(joined_key)
+        if joined is None:
+            joined = self._concatenate(path, self._segment(key))
+            self._joined[joined_key] = joined
+        return joined
+
+    def generic_child(self, generic_path, key):
+        """Returns the generic path of the key under the generic path."""
+        child_key = (generic_path, self._generic_segment(key))
+        generic = self._generic_children.get(child_key)
+        if generic is None:
+            generic = self._concatenate(*child_key)
+            generic = self._generic_paths.setdefault(generic, generic)
+            self._generic_children[child_key] = generic
+        return generic
+
+    def generalize(self, path):
+        """Returns the generic form of any path."""
+        generic = self._generalized.get(path)
+        if generic is None:
+            generic = "/"
+            for part in path.split('/'):
+                generic = self.generic_child(generic, part)
+            self._generalized[path] = generic
+        return generic
+
 def filter_comments(mixed):
     lambda_filter = lambda key: not key.startswith('__') and \
                                 not key in ["name", "description"]
@@ -48,3 +131,20 @@ def filter_comments(mixed):
         return filter(lambda_filter, mixed)
     else:
         return mixed
+
+def content_digest(content):
+    if isinstance(content, unicode):
+        content = content.encode("utf-8")
+    return hashlib.sha1(content).hexdigest()
+
+def format_table(rows):
+    """Aligns rows of strings into columns, the first one to the left."""
+    widths = [max([len(row[i]) for row in rows])
+              for i in range(0, len(rows[0]))]
+    lines = []
+    for row in rows:
+        cells = [row[0].ljust(widths[0])]
+        for i in range(1, len(row)):
+            cells.append(row[i].rjust(widths[i]))
+        lines.append("  ".join(cells))
+    return "\n".join(lines)
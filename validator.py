@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 from assertion import *
 from util import *
-import re, sys
+import os, re, sys
 
 class SchemaError(Exception):
     """Error raised when detected a schema problem."""
@@ -19,22 +19,27 @@ class TemplateError(Exception):
     """Error raised when there is a template issue."""
     pass
 
-class Validator(object):
-    def __init__(self, spec, schema):
-        self._rule_method = {"matches": self._assert_matches,
-                             "has_keys": self._assert_has_keys,
-                             "each_value": self._assert_each_value}
+class CompiledSchema(object):
+    """A schema prepared for validating any number of specs.
+
+       Meta schema references are resolved once and the rules of each path
+       are turned into checker functions. Problems found while compiling are
+       only raised when a spec reaches them, the same as when the schema is
+       interpreted."""
+
+    def __init__(self, schema):
+        self._rule_method = {"matches": self._compile_matches,
+                             "has_keys": self._compile_has_keys,
+                             "each_value": self._compile_each_value}
         self._assert_method = {"non_empty_string": assert_non_empty_string,
                                "non_empty_list": assert_non_empty_list,
                                "non_empty_dict": assert_non_empty_dict,
                                "integer": assert_integer,
                                "existing_file": assert_file_exists}
-        self.spec = spec
         self.schema = schema
-
-    def validate(self, error_details={}):
         self.meta_schema_map = {}
         self.leafs = {}
+        self.paths = PathInterner()
         self._meta_schema = {}
         self._rule_map = {}
         self._create_rule_map(self.schema, path="")
@@ -64,7 +69,12 @@ class Validator(object):
                     self.meta_schema_map[normalize_path(path + "/" + k)] = \
                         valid_values
 
-        self._validate(self.spec, self._rule_map, error_details=error_details)
+        # Path to a list of (rule, expectation, checker).
+        self.checks = {}
+        for path, assertions in self._rule_map.iteritems():
+            self.checks[path] = [(rule, expectation,
+                                  self._compile_rule(rule, expectation))
+                                 for rule, expectation in assertions]
 
     def _is_node(self, key):
         return key.startswith("/")
@@ -76,7 +86,7 @@ class Validator(object):
         return key in self._rule_method
 
     def _is_assertion(self, key):
-        return key in self._assert_method
+        return isinstance(key, basestring) and key in self._assert_method
 
     def _is_meta_schema_reference(self, token):
         return hasattr(token, 'startswith') and token.startswith("@")
@@ -93,53 +103,76 @@ class Validator(object):
                 raise SchemaError("Invalid meta schema reference '%s'" % token)
         return meta_schema
 
-    def _assert_matches(self, expectation, value):
+    def _raiser(self, error):
+        def check(*args):
+            raise error
+        return check
+
+    def _compile_rule(self, rule, expectation):
+        """Returns the checker of a node's left handside rule."""
+        if self._is_meta_schema_reference(expectation):
+            try:
+                expectation = self._expand_meta_schema_reference(expectation)
+            except SchemaError, err:
+                return self._raiser(err)
+        return self._rule_method[rule](expectation)
+
+    def _compile_matches(self, expectation):
         if not isinstance(expectation, dict):
-            raise SchemaError("Schema rule \"matches\" expects a dict " + \
-                              "or meta schema reference, got '%s'" % \
-                              expectation)
-        assert_contains_only_fields(value, expectation.keys())
-        for key, method in expectation.iteritems():
-            self._assert_spec_value(method, None, value, key)
-
-    def _assert_each_value(self, expectation, mixed):
-        if isinstance(mixed, dict):
-            keys = mixed
-        elif isinstance(mixed, list):
-            keys = range(0, len(mixed))
-
-        for key in keys:
-            self._assert_spec_value(expectation, None, mixed, key)
-
-    def _assert_has_keys(self, expectation, value):
-        assert_contains_only_fields(value, expectation)
-
-    def _assert_spec_value(self, method, expectation, value, key):
+            return self._raiser(SchemaError(
+                "Schema rule \"matches\" expects a dict " + \
+                "or meta schema reference, got '%s'" % expectation))
+        fields = expectation.keys()
+        value_checks = [(key, self._compile_spec_value(method))
+                        for key, method in expectation.iteritems()]
+        def check(value, validator):
+            assert_contains_only_fields(value, fields)
+            for key, check_value in value_checks:
+                check_value(value, key, validator)
+        return check
+
+    def _compile_each_value(self, expectation):
+        check_value = self._compile_spec_value(expectation)
+        def check(mixed, validator):
+            if isinstance(mixed, dict):
+                keys = mixed
+            elif isinstance(mixed, list):
+                keys = range(0, len(mixed))
+
+            for key in keys:
+                check_value(mixed, key, validator)
+        return check
+
+    def _compile_has_keys(self, expectation):
+        def check(value, validator):
+            assert_contains_only_fields(value, expectation)
+        return check
+
+    def _compile_spec_value(self, method):
         if self._is_meta_schema_reference(method):
-            expectation = self._expand_meta_schema_reference(method)
-            assert_valid_subset(value, key, expectation)
+            try:
+                expectation = self._expand_meta_schema_reference(method)
+            except SchemaError, err:
+                return self._raiser(err)
         elif isinstance(method, list):
             expectation = method
-            assert_valid_subset(value, key, expectation)
         elif self._is_assertion(method):
             assertion_method = self._assert_method[method]
-            assertion_method(value, key)
+            if assertion_method is assert_file_exists:
+                # Checked in one batch once the whole spec is traversed.
+                def check(value, key, validator):
+                    validator.defer_file_check(value, key)
+            else:
+                def check(value, key, validator):
+                    assertion_method(value, key)
+            return check
         else:
-            raise SchemaError('Non-existing assertion method "%s"' % method)
+            return self._raiser(
+                SchemaError('Non-existing assertion method "%s"' % method))
 
-    def _validate_rule(self, rule, expectation, value):
-        """Validates a node's left handside rule."""
-        if self._is_meta_schema_reference(expectation):
-            expectation = self._expand_meta_schema_reference(expectation)
-
-        try:
-            if rule in self._rule_method:
-                rule_method = self._rule_method[rule]
-                rule_method(expectation, value)
-            else:
-                raise NotReachedError(rule)
-        except AssertionError, err:
-            raise SpecError(err)
+        def check(value, key, validator):
+            assert_valid_subset(value, key, expectation)
+        return check
 
     def _create_rule_map(self, schema, path=""):
         if not isinstance(schema, dict):
@@ -211,18 +244,88 @@ class Validator(object):
         except AssertionError, err:
             raise SchemaError(err)
 
-    def _validate(self, value, rule_map, path="/", error_details={}):
-        path = normalize_path(path)
+class Validator(object):
+    """Validates a spec against a schema, which is compiled on the first
+       validation unless a CompiledSchema is given.
+
+       Fields which must be existing files are collected while traversing
+       the spec and checked together at the end, on file_check_threads
+       threads if more than one, so every missing file is reported at
+       once."""
+
+    def __init__(self, spec, schema, file_check_threads=0):
+        self.spec = spec
+        self.file_check_threads = file_check_threads
+        if isinstance(schema, CompiledSchema):
+            self.compiled_schema = schema
+            self.schema = schema.schema
+        else:
+            self.compiled_schema = None
+            self.schema = schema
+
+    def validate(self, error_details={}):
+        self.start()
+        self.validate_value(self.spec, "/", error_details=error_details)
+        self.finish(error_details=error_details)
+
+    def start(self):
+        """Starts validating a spec which is given part by part."""
+        if self.compiled_schema is None:
+            self.compiled_schema = CompiledSchema(self.schema)
+        self.meta_schema_map = self.compiled_schema.meta_schema_map
+        self.leafs = self.compiled_schema.leafs
+        self._file_checks = []
+        self._paths = self.compiled_schema.paths
+
+    def validate_value(self, value, path, error_details={}, skip_keys=()):
+        """Validates a part of the spec found at the generic path, leaving
+           out the children under skip_keys."""
+        self._validate(value, self.compiled_schema.checks,
+                       normalize_path(path), error_details, skip_keys)
+
+    def finish(self, error_details={}):
+        """Checks the deferred existing_file fields."""
+        self._check_files(error_details)
+
+    def defer_file_check(self, obj, field):
+        self._file_checks.append((os.path.expanduser(obj[field]), field,
+                                  self._path, obj[field]))
+
+    def _check_files(self, error_details):
+        exists = files_exist([filename for filename, field, path, value
+                              in self._file_checks],
+                             threads=self.file_check_threads)
+        missing = [(filename, field, path, value)
+                   for filename, field, path, value in self._file_checks
+                   if not exists[filename]]
+        if not missing:
+            return
+        filename, field, path, value = missing[0]
         error_details["path"] = path
         error_details["value"] = value
-        if len(rule_map.keys()) == 0 and path != "/":
+        error_details["expectation"] = "existing_file"
+        error_details["missing_files"] = [filename for filename, field, path,
+                                          value in missing]
+        raise SpecError("\n".join(['Field "%s" must be an existing file: '
+                                   '%s (at %s)' % (field, filename, path)
+                                   for filename, field, path, value
+                                   in missing]))
+
+    def _validate(self, value, checks, path="/", error_details={},
+                  skip_keys=()):
+        error_details["path"] = path
+        error_details["value"] = value
+        self._path = path
+        if len(checks) == 0 and path != "/":
             raise SpecError('No schema rule for path "%s"' % path)
 
-        if path in rule_map:
-            for assertion in rule_map[path]:
-                rule, expectation = assertion
+        if path in checks:
+            for rule, expectation, check in checks[path]:
                 error_details["expectation"] = expectation
-                self._validate_rule(rule, expectation, value)
+                try:
+                    check(value, self)
+                except AssertionError, err:
+                    raise SpecError(err)
 
         if isinstance(value, dict):
             sequence = value.iteritems()
@@ -232,9 +335,11 @@ class Validator(object):
             raise SchemaError("Unexpected value: %s" % str(value))
 
         for k, v in sequence:
+            if k in skip_keys:
+                continue
             if isinstance(v, dict) or isinstance(v, list):
-                next_path = path + "/" + k
-                self._validate(v, rule_map, next_path, error_details)
+                next_path = self._paths.join(path, k)
+                self._validate(v, checks, next_path, error_details)
 
 def main(args):
     spec = load_json(args.spec)
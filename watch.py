@@ -0,0 +1,81 @@
+import os
+import time
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+def signature(path):
+    """Returns the (mtime, size) of a file or directory, None if it does not
+       exist."""
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return None
+    return (stat_result.st_mtime, stat_result.st_size)
+
+class Watcher(object):
+    """Waits for watched files to change.
+
+       The files are given with the signature they had when they were read,
+       so a change made while generating is noticed right after. The
+       directories holding them are watched too, for files which get added,
+       such as a template which was missing. The directories are taken as
+       they are when watching starts, after the outputs have been written.
+
+       Changes are polled for every interval seconds, or waited for with
+       inotify where pyinotify is installed."""
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self._signatures = {}
+
+    def watch(self, files):
+        """Watches the files of the {path: signature} given instead of the
+           previous ones."""
+        self._signatures = dict(files)
+        for path in files.keys():
+            directory = os.path.dirname(path)
+            if not directory in files:
+                self._signatures[directory] = signature(directory)
+
+    def changes(self):
+        """Returns the watched paths which changed, in order."""
+        return sorted([path for path, known in self._signatures.iteritems()
+                       if signature(path) != known])
+
+    def wait(self):
+        """Returns the changed paths once there are any."""
+        if pyinotify is not None:
+            return self._wait_for_events()
+        while True:
+            changed = self.changes()
+            if changed:
+                return changed
+            time.sleep(self.interval)
+
+    def _wait_for_events(self):
+        manager = pyinotify.WatchManager()
+        notifier = pyinotify.Notifier(manager, pyinotify.ProcessEvent(),
+                                      timeout=self.interval * 1000)
+        mask = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MODIFY | \
+               pyinotify.IN_ATTRIB | pyinotify.IN_CREATE | \
+               pyinotify.IN_DELETE | pyinotify.IN_MOVED_TO | \
+               pyinotify.IN_MOVED_FROM
+        directories = set([path for path in self._signatures.keys()
+                           if os.path.isdir(path)])
+        for directory in directories:
+            manager.add_watch(directory, mask)
+        try:
+            while True:
+                changed = self.changes()
+                if changed:
+                    return changed
+                # Events only tell when to look again, the signatures tell
+                # what changed.
+                if notifier.check_events():
+                    notifier.read_events()
+                    notifier.process_events()
+        finally:
+            notifier.stop()
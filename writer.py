@@ -0,0 +1,474 @@
+from util import content_digest
+import Queue
+import cStringIO
+import json
+import os
+import struct
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import warnings
+import zipfile
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+class OutputWriter(object):
+    def __init__(self):
+        self._directories = set([""])
+
+    def write(self, filename, content):
+        self._make_directory(os.path.dirname(filename))
+        self._unshare(filename)
+        with open(filename, "w") as f:
+            f.write(content)
+
+    def _unshare(self, filename):
+        # Writing through a hard link, such as one left by --dedup, would
+        # change the files it is shared with.
+        try:
+            if os.lstat(filename).st_nlink > 1:
+                os.unlink(filename)
+        except OSError:
+            pass
+
+    def _make_directory(self, full_path):
+        # Directories created once are remembered to save the syscalls.
+        if full_path in self._directories:
+            return
+        try:
+            os.makedirs(full_path)
+        except OSError:
+            if not os.path.isdir(full_path):
+                raise
+        self._directories.add(full_path)
+
+    def close(self):
+        pass
+
+    def abort(self):
+        """Stops writing after a failed run, without raising."""
+        pass
+
+class ContentIndex(object):
+    """Remembers which path holds each distinct content written so far.
+
+       A path written again with other content stops holding its previous
+       content, so nothing is ever linked to a path whose content changed."""
+
+    def __init__(self):
+        self.links = 0
+        self.saved_bytes = 0
+        self._holders = {}
+        self._digests = {}
+
+    def holder(self, filename, content):
+        """Records that filename now holds the content and returns the path
+           which already held the same content, None if there is none."""
+        digest = content_digest(content)
+        previous = self._digests.get(filename)
+        if previous is not None:
+            self._holders[previous].remove(filename)
+        self._digests[filename] = digest
+        holders = self._holders.setdefault(digest, [])
+        holder = holders[0] if holders else None
+        holders.append(filename)
+        return holder
+
+    def linked(self, size):
+        self.links += 1
+        self.saved_bytes += size
+
+    def report(self):
+        return "Deduplicated %d files, saving %d bytes and %d inodes" % \
+               (self.links, self.saved_bytes, self.links)
+
+class DedupWriter(OutputWriter):
+    """Writes each distinct content once. Files with the same content as a
+       file written before become hard links to it.
+
+       Every path is unlinked before it is written, as it may be a link
+       shared with other files of this or a previous run. Where links are
+       not supported the file is written as usual."""
+
+    def __init__(self):
+        OutputWriter.__init__(self)
+        self.index = ContentIndex()
+
+    def write(self, filename, content):
+        if isinstance(content, unicode):
+            content = content.encode("utf-8")
+        holder = self.index.holder(filename, content)
+        self._make_directory(os.path.dirname(filename))
+        try:
+            os.unlink(filename)
+        except OSError:
+            pass
+        if holder is not None:
+            try:
+                os.link(holder, filename)
+                self.index.linked(len(content))
+                return
+            except OSError:
+                pass
+        OutputWriter.write(self, filename, content)
+
+    def report(self):
+        return self.index.report()
+
+class DryRunWritter(object):
+    def write(self, filename, content):
+        print filename, content
+
+    def close(self):
+        pass
+
+    def abort(self):
+        pass
+
+class ThreadedWriter(OutputWriter):
+    """Writes files on a bounded pool of threads.
+
+       Writes are queued in batches. Each path is always handled by the same
+       thread so writes to colliding paths keep their order. The first write
+       error is raised again by flush or close."""
+
+    def __init__(self, threads=8, batch_size=32, max_pending_batches=4):
+        OutputWriter.__init__(self)
+        self.threads = threads
+        self.batch_size = batch_size
+        self.max_pending_batches = max_pending_batches
+        self._batches = [[] for i in range(0, threads)]
+        self._queues = None
+        self._workers = []
+        self._error = None
+
+    def write(self, filename, content):
+        if self._queues is None:
+            self._start()
+        thread_index = hash(filename) % self.threads
+        batch = self._batches[thread_index]
+        batch.append((filename, content))
+        if len(batch) >= self.batch_size:
+            self._submit(thread_index)
+
+    def _start(self):
+        self._queues = []
+        for i in range(0, self.threads):
+            queue = Queue.Queue(self.max_pending_batches)
+            worker = threading.Thread(target=self._work, args=(queue,))
+            worker.daemon = True
+            worker.start()
+            self._queues.append(queue)
+            self._workers.append(worker)
+
+    def _submit(self, thread_index):
+        self._queues[thread_index].put(self._batches[thread_index])
+        self._batches[thread_index] = []
+
+    def _work(self, queue):
+        while True:
+            batch = queue.get()
+            try:
+                if batch is None:
+                    return
+                for filename, content in batch:
+                    if self._error is not None:
+                        break
+                    try:
+                        OutputWriter.write(self, filename, content)
+                    except:
+                        self._error = sys.exc_info()
+            finally:
+                queue.task_done()
+
+    def flush(self):
+        """Waits until all queued writes are done."""
+        if self._queues is None:
+            return
+        for thread_index in range(0, self.threads):
+            if self._batches[thread_index]:
+                self._submit(thread_index)
+        for queue in self._queues:
+            queue.join()
+        self._raise_error()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            if self._queues is not None:
+                for queue in self._queues:
+                    queue.put(None)
+                for worker in self._workers:
+                    worker.join()
+                self._queues = None
+                self._workers = []
+
+    def abort(self):
+        """Stops the threads once the queued writes are done. A write error
+           is dropped, the run already failed."""
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error[0], error[1], error[2]
+
+class ManifestWriter(object):
+    """Skips writing outputs whose content did not change since the last run.
+
+       A manifest of output path to content hash is kept next to the output
+       tree. Files listed in the previous manifest which were not produced
+       by this run are stale and can optionally be pruned."""
+
+    def __init__(self, writer, manifest_path, prune=False):
+        self.writer = writer
+        self.manifest_path = manifest_path
+        self.prune = prune
+        self.written = 0
+        self.unchanged = 0
+        self.stale = []
+        self._previous = self._load()
+        self._manifest = {}
+
+    def _load(self):
+        if not os.path.isfile(self.manifest_path):
+            return {}
+        with open(self.manifest_path) as f:
+            try:
+                return json.load(f)["files"]
+            except (ValueError, KeyError, TypeError):
+                # A broken manifest only means everything gets rewritten.
+                return {}
+
+    def write(self, filename, content):
+        digest = content_digest(content)
+        if filename in self._manifest:
+            on_disk = self._manifest[filename]
+        elif self._previous.get(filename) == digest and \
+             os.path.isfile(filename):
+            on_disk = digest
+        else:
+            on_disk = None
+
+        if on_disk == digest:
+            self.unchanged += 1
+        else:
+            self.writer.write(filename, content)
+            self.written += 1
+        self._manifest[filename] = digest
+
+    def retain(self, filename):
+        """Keeps a file produced by an earlier run in the manifest."""
+        if filename in self._previous and not filename in self._manifest:
+            self._manifest[filename] = self._previous[filename]
+
+    def close(self):
+        self.writer.close()
+        self.stale = sorted([filename for filename in self._previous
+                             if not filename in self._manifest])
+        for filename in self.stale:
+            if not self.prune:
+                # Stale files stay listed so a later run can still prune them.
+                self._manifest[filename] = self._previous[filename]
+                continue
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+        with open(self.manifest_path, "w") as f:
+            json.dump({"files": self._manifest}, f, indent=0, sort_keys=True)
+
+    def abort(self):
+        self.writer.abort()
+
+    def report(self):
+        return "Written: %d, unchanged: %d, stale: %d%s" % \
+               (self.written, self.unchanged, len(self.stale),
+                " (pruned)" if self.prune and self.stale else "")
+
+class GzipStream(object):
+    """Compresses what is written to a file object into a gzip stream with
+       the given timestamp. gzip.GzipFile only takes the timestamp from
+       Python 2.7 on, and stores the current time before."""
+
+    def __init__(self, fileobj, mtime):
+        self._file = fileobj
+        self._compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS,
+                                            zlib.DEF_MEM_LEVEL, 0)
+        self._crc = zlib.crc32("") & 0xffffffff
+        self._size = 0
+        # The magic, deflate, no flags, the timestamp, the best compression
+        # and an unknown system, as gzip.GzipFile writes it.
+        self._file.write("\037\213\010\000" + struct.pack("<I", mtime) +
+                         "\002\377")
+
+    def write(self, data):
+        self._crc = zlib.crc32(data, self._crc) & 0xffffffff
+        self._size += len(data)
+        self._file.write(self._compressor.compress(data))
+
+    def tell(self):
+        return self._size
+
+    def close(self):
+        self._file.write(self._compressor.flush())
+        self._file.write(struct.pack("<II", self._crc,
+                                     self._size & 0xffffffff))
+
+class ArchiveWriter(object):
+    """Writes the outputs as members of a tar or zip archive.
+
+       The format follows the extension of the archive: .tar, .tar.gz or
+       .tgz, .tar.bz2 or .tbz2, .tar.xz or .txz (only where the lzma module
+       is available) and .zip. Members are added in the order they are
+       written, which is the generation order, and get the same timestamp,
+       owner and permissions on every run, so the same outputs give the same
+       archive. The timestamp is SOURCE_DATE_EPOCH if set, else 1980-01-01,
+       the earliest a zip file can hold.
+
+       A path written more than once is added more than once, extracting
+       the archive keeps the last one, the same as when writing files.
+
+       With dedup, a tar member with the same content as an earlier one is
+       added as a hard link to it. If colliding paths are linked, the
+       archive has to be extracted by a tool which replaces existing files
+       rather than writing into them, as tar does. Zip files have no links
+       and always hold the full content."""
+
+    def __init__(self, archive_path, dedup=False):
+        self.archive_path = archive_path
+        self.members = 0
+        self.index = None
+        self.mtime = int(os.environ.get("SOURCE_DATE_EPOCH", 315532800))
+        self._temp_path = None
+        self._file = None
+        self._compressor = None
+        self._tar = None
+        self._zip = None
+
+        name = archive_path.lower()
+        if name.endswith(".zip"):
+            self._format = "zip"
+        elif name.endswith(".tar"):
+            self._format = "tar"
+        elif name.endswith(".tar.gz") or name.endswith(".tgz"):
+            self._format = "gz"
+        elif name.endswith(".tar.bz2") or name.endswith(".tbz2"):
+            self._format = "bz2"
+        elif name.endswith(".tar.xz") or name.endswith(".txz"):
+            if lzma is None:
+                raise ValueError("Writing %s needs the lzma module" %
+                                 archive_path)
+            self._format = "xz"
+        else:
+            raise ValueError("Unknown archive format: %s" % archive_path)
+        if dedup and self._format != "zip":
+            self.index = ContentIndex()
+
+    def _open(self):
+        # Written next to the archive and renamed over it by close(), so a
+        # run which fails or writes nothing leaves a previous archive alone.
+        directory, basename = os.path.split(os.path.abspath(self.archive_path))
+        handle, self._temp_path = tempfile.mkstemp(dir=directory,
+                                                   prefix="." + basename + ".")
+        os.close(handle)
+        if self._format == "zip":
+            self._zip = zipfile.ZipFile(self._temp_path, "w",
+                                        zipfile.ZIP_DEFLATED, allowZip64=True)
+            return
+        if self._format == "tar":
+            self._tar = tarfile.open(self._temp_path, "w")
+        elif self._format == "gz":
+            # Through GzipFile, tarfile would store the current time.
+            self._file = open(self._temp_path, "wb")
+            self._compressor = GzipStream(self._file, self.mtime)
+        elif self._format == "bz2":
+            self._tar = tarfile.open(self._temp_path, "w:bz2")
+        else:
+            self._compressor = lzma.LZMAFile(self._temp_path, "w")
+        if self._tar is None:
+            self._tar = tarfile.open(fileobj=self._compressor, mode="w")
+
+    def _member_name(self, filename):
+        return os.path.normpath(filename).replace(os.sep, "/").lstrip("/")
+
+    def write(self, filename, content):
+        if isinstance(content, unicode):
+            content = content.encode("utf-8")
+        name = self._member_name(filename)
+        if self._temp_path is None:
+            self._open()
+        if self._zip is not None:
+            # Zip timestamps start at 1980.
+            info = zipfile.ZipInfo(name,
+                                   time.gmtime(max(self.mtime, 315532800))[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0644 << 16
+            with warnings.catch_warnings():
+                # Colliding paths are added again on purpose.
+                warnings.simplefilter("ignore")
+                self._zip.writestr(info, content)
+        else:
+            info = tarfile.TarInfo(name)
+            info.mtime = self.mtime
+            info.mode = 0644
+            holder = None
+            if self.index is not None:
+                holder = self.index.holder(name, content)
+            if holder is not None:
+                info.type = tarfile.LNKTYPE
+                info.linkname = holder
+                self._tar.addfile(info)
+                self.index.linked(len(content))
+            else:
+                info.size = len(content)
+                self._tar.addfile(info, cStringIO.StringIO(content))
+        self.members += 1
+
+    def _close_archive(self):
+        if self._zip is not None:
+            self._zip.close()
+            return
+        self._tar.close()
+        if self._compressor is not None:
+            self._compressor.close()
+        if self._file is not None:
+            self._file.close()
+
+    def close(self):
+        if self._temp_path is None:
+            self._open()
+        self._close_archive()
+        # mkstemp() creates the file readable by the owner only.
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(self._temp_path, 0666 & ~umask)
+        os.rename(self._temp_path, self.archive_path)
+        self._temp_path = None
+
+    def abort(self):
+        """Drops what was written, leaving a previous archive in place."""
+        if self._temp_path is None:
+            return
+        try:
+            self._close_archive()
+        finally:
+            os.remove(self._temp_path)
+            self._temp_path = None
+
+    def report(self):
+        report = "Archived %d files into %s" % (self.members,
+                                                self.archive_path)
+        if self.index is not None:
+            report += "\n" + self.index.report()
+        return report